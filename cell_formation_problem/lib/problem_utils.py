@@ -2,6 +2,23 @@
 
 from copy import copy as shallowcopy
 from decimal import Decimal
+import numpy as np
+
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('../../common'):
+    import instance_cache
 
 
 class Solution(object):
@@ -64,7 +81,36 @@ class Solution(object):
 class Scheme(object):
     """Scheme of machines and corresponding parts"""
     def __init__(self, io_stream):
-        m, p, data = Scheme.parse_instance(io_stream)
+        self._build(*Scheme.parse_instance(io_stream))
+
+    @classmethod
+    def from_file(cls, instance_path, use_cache=True):
+        """
+        Construct scheme from instance file
+
+        Machine-part incidence matrix is cached on disk next to the instance
+        and read from the cache instead of parsing on next load. The cached
+        matrix is converted to nested lists: scalar lookups on Python ints
+        are faster than on numpy scalars
+        """
+        if not use_cache:
+            with open(instance_path, 'r') as instance_file:
+                return cls(instance_file)
+        path = instance_cache.cache_path(instance_path)
+        arrays = instance_cache.load(path, ['matrix'])
+        if arrays is None:
+            with open(instance_path, 'r') as instance_file:
+                scheme = cls(instance_file)
+            instance_cache.save(path, {
+                'matrix': np.array(scheme.matrix, dtype=np.int8)})
+            return scheme
+        scheme = cls.__new__(cls)
+        m, p = arrays['matrix'].shape
+        scheme._build(m, p, arrays['matrix'].tolist())
+        return scheme
+
+    def _build(self, m, p, data):
+        """Set up scheme from parsed instance"""
         self._mn = m
         self._pn = p
         self._matrix = data
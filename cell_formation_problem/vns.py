@@ -47,6 +47,9 @@ def parse_args():
         help='Algorithm max iterations',
         type=int,
         default=2000)
+    parser.add_argument('--no-cache',
+        action='store_true',
+        help='Do not use on-disk cache of parsed instances')
     return parser.parse_args()
 
 
@@ -108,8 +111,7 @@ def main():
     print(args.instances)
     for instance in args.instances:
         name = os.path.splitext(os.path.basename(instance))[0]
-        with open(instance, 'r') as instance_file:
-            scheme = Scheme(instance_file)
+        scheme = Scheme.from_file(instance, use_cache=not args.no_cache)
         print('-'*100)
         print('File: {name}.txt'.format(name=name))
         start = time.time()
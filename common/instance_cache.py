@@ -0,0 +1,73 @@
+"""
+On-disk cache of parsed instances
+
+Arrays are stored as .npy files in .cache/<instance>-<digest>/ next to the
+instance file, digest is taken from the instance file contents. Cached arrays
+are memory-mapped on load.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import numpy as np
+
+
+def _digest(instance_path):
+    """Hash of instance file contents"""
+    sha = hashlib.sha1()
+    with open(instance_path, 'rb') as instance_file:
+        for block in iter(lambda: instance_file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()[:16]
+
+
+def cache_path(instance_path):
+    """Directory with cached arrays of instance"""
+    instance_path = os.path.abspath(instance_path)
+    return os.path.join(os.path.dirname(instance_path), '.cache',
+        '{name}-{digest}'.format(
+            name=os.path.basename(instance_path),
+            digest=_digest(instance_path)))
+
+
+def load(path, names):
+    """
+    Load cached arrays from cache directory
+
+    Return dict of memory-mapped arrays or None if any array is missing
+    """
+    arrays = {}
+    for name in names:
+        array_path = os.path.join(path, '{name}.npy'.format(name=name))
+        if not os.path.exists(array_path):
+            return None
+        arrays[name] = np.load(array_path, mmap_mode='r')
+    return arrays
+
+
+def save(path, arrays, ignore_errors=True):
+    """
+    Save arrays to cache directory
+
+    Arrays are written to a temporary directory which is then renamed, so
+    concurrent runs never see partially written cache. Failures (i.e.
+    read-only file system) are ignored unless ignore_errors is False: cache
+    is optional
+    """
+    tmp_path = None
+    parent = os.path.dirname(os.path.abspath(path))
+    try:
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=parent)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, '{name}.npy'.format(name=name)),
+                array)
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+    except OSError:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        if not ignore_errors:
+            raise
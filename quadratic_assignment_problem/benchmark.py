@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Benchmark of QAP solvers against best-known solutions
+
+Chosen solver is run over instances with fixed seed and budget. Objective
+evaluations per second, time to reach target (best-known value plus allowed
+gap), final gap to best-known value and peak resident memory are reported and
+optionally saved as JSON or compared against a saved baseline: exit code is
+non-zero if any instance got a worse objective value or lost more throughput
+than tolerated. Baseline saved with other run settings is refused
+
+Throughput is measured over the solver search loop only (without parsing and
+process start-up), the best of repeated runs is kept. Runs shorter than the
+minimum search time are too noisy for a throughput verdict and only their
+objective values are compared
+"""
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('.'):
+    from lib.problem_utils import Problem
+    from lib.problem_utils import QapObjective
+    from lib.lower_bound import gap
+    from lib.constraints import satisfies_constraints
+    from ga import genetic_algorithm
+    from tabu import tabu_search
+    from sa import simulated_annealing
+
+
+# best-known objective values (QAPLIB)
+BEST_KNOWN = {
+    'tai20a': 703482,
+    'tai40a': 3139370,
+    'tai60a': 7205962,
+    'tai80a': 13499184,
+    'tai100a': 21043560,
+}
+
+# default budget (max iterations) per solver
+MAX_ITER = {
+    'ga': 1000,
+    'tabu': 10000,
+    'sa': 20000,
+}
+
+# report keys that must match for results to be comparable
+RUN_SETTINGS = ('solver', 'max_iter', 'time_limit', 'seed', 'target_gap')
+
+
+def _run_ga(problem, time_limit, max_iter, seed, stats):
+    """Run single population GA"""
+    problem.population_size = 30
+    return genetic_algorithm(problem, time_limit, max_iter, seed=seed,
+        stats=stats)
+
+
+def _run_tabu(problem, time_limit, max_iter, seed, stats):
+    """Run robust tabu search"""
+    return tabu_search(problem, time_limit, max_iter, seed, stats=stats)
+
+
+def _run_sa(problem, time_limit, max_iter, seed, stats):
+    """Run simulated annealing in a single process"""
+    return simulated_annealing(problem, time_limit, max_iter, seed=seed,
+        stats=stats)
+
+
+def solvers():
+    """Return available solvers"""
+    return {
+        'ga': _run_ga,
+        'tabu': _run_tabu,
+        'sa': _run_sa,
+    }
+
+
+def parse_args():
+    """Parse command-line arguments"""
+    filedir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser("QAP benchmark")
+    parser.add_argument('instances',
+        nargs='*',
+        help='QAP problem instance(s) (default: _problems)',
+        default=sorted(glob.glob(os.path.join(filedir, '_problems', '*'))))
+    parser.add_argument('--solver',
+        choices=solvers().keys(),
+        default='tabu')
+    parser.add_argument('--time-limit',
+        help='Time limit per instance (in seconds)',
+        type=int,
+        default=60)
+    parser.add_argument('--max-iter',
+        help='Iterations per instance (default: {d})'.format(d=', '.join(
+            '{s}: {i}'.format(s=s, i=i) for s, i in sorted(MAX_ITER.items()))),
+        type=int,
+        default=None)
+    parser.add_argument('--seed',
+        help='Random seed',
+        type=int,
+        default=11)
+    parser.add_argument('--target-gap',
+        help='Gap to best-known value (in percent) counted as reached target',
+        type=float,
+        default=1.0)
+    parser.add_argument('--output',
+        help='Save results to JSON file',
+        default=None)
+    parser.add_argument('--baseline',
+        help='Compare results against JSON file saved by --output with the '
+            'same solver, budget, seed and target gap',
+        default=None)
+    parser.add_argument('--tolerance',
+        help='Allowed loss of evaluations per second against baseline (in '
+            'percent)',
+        type=float,
+        default=20.0)
+    parser.add_argument('--repeats',
+        help='Runs per instance, the one with the best throughput is kept',
+        type=int,
+        default=1)
+    parser.add_argument('--min-seconds',
+        help='Minimum search time (in seconds) for throughput to be compared '
+            'against baseline',
+        type=float,
+        default=2.0)
+    return parser.parse_args()
+
+
+def time_to_target(trace, target):
+    """First moment the best objective value was not greater than target"""
+    for seconds, objective in trace:
+        if objective <= target:
+            return seconds
+    return None
+
+
+def run_instance(solver, instance, time_limit, max_iter, seed, target_gap):
+    """
+    Run solver on instance, return result record
+
+    Meant to run in a fresh worker process, so that peak resident memory
+    belongs to this instance only
+    """
+    name = os.path.splitext(os.path.basename(instance))[0]
+    problem = Problem.from_file(instance)
+    stats = {}
+    start = time.time()
+    # solvers report progress on their own
+    with contextlib.redirect_stdout(io.StringIO()):
+        S = solvers()[solver](problem, time_limit, max_iter, seed, stats)
+    elapsed = time.time() - start
+    search_seconds = stats['seconds']
+    # kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    objective_value = QapObjective()(problem, S)
+    if not satisfies_constraints(problem, S):
+        raise ValueError('{s} returned infeasible solution for {name}'.format(
+            s=solver, name=name))
+    best_known = BEST_KNOWN.get(name)
+    target = None
+    if best_known is not None:
+        target = best_known * (1 + target_gap / 100.0)
+    return name, {
+        'n': problem.n,
+        'objective': objective_value,
+        'best_known': best_known,
+        'gap': None if best_known is None else gap(objective_value, best_known),
+        'seconds': elapsed,
+        'search_seconds': search_seconds,
+        'evaluations': stats['evaluations'],
+        'evaluations_per_second': stats['evaluations'] / search_seconds
+            if search_seconds else 0.0,
+        'time_to_target': None if target is None else time_to_target(
+            stats['trace'], target),
+        'peak_memory_mb': peak / float(1 << 20),
+    }
+
+
+def _format(value, spec):
+    """Format optional value"""
+    return '-' if value is None else spec.format(value)
+
+
+def print_results(results):
+    """Print results table"""
+    row = '{:<10} {:>5} {:>12} {:>12} {:>8} {:>9} {:>12} {:>9} {:>9}'
+    print(row.format('instance', 'n', 'O*', 'best known', 'gap,%', 'time,s',
+        'evals/s', 'ttt,s', 'peak,MB'))
+    for name, result in results.items():
+        print(row.format(name, result['n'], result['objective'],
+            _format(result['best_known'], '{}'),
+            _format(result['gap'], '{:.2f}'),
+            '{:.2f}'.format(result['seconds']),
+            '{:.0f}'.format(result['evaluations_per_second']),
+            _format(result['time_to_target'], '{:.2f}'),
+            '{:.1f}'.format(result['peak_memory_mb'])))
+
+
+def settings_mismatches(settings, baseline):
+    """Return run settings that differ from baseline ones"""
+    return [key for key in RUN_SETTINGS
+        if baseline.get(key) != settings[key]]
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    """
+    Print changes against baseline results, return number of regressions
+    (worse objective value or evaluations per second dropped by more than
+    tolerance percent)
+
+    Note: throughput of runs searching less than min_seconds (in either
+    results) is not compared
+    """
+    row = '{:<10} {:>12} {:>12} {:>10} {:>12} {:>12}'
+    print(row.format('instance', 'O*', 'baseline O*', 'evals/s,%', 'ttt,s',
+        'baseline ttt'))
+    regressions = 0
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        speed = None
+        if min(result['search_seconds'], base.get('search_seconds', 0.0)) \
+                >= min_seconds and base['evaluations_per_second']:
+            speed = 100.0 * (result['evaluations_per_second'] /
+                base['evaluations_per_second'] - 1)
+        regressed = result['objective'] > base['objective'] or \
+            (speed is not None and speed < -tolerance)
+        regressions += regressed
+        print(row.format(name, result['objective'], base['objective'],
+            _format(speed, '{:+.1f}'),
+            _format(result['time_to_target'], '{:.2f}'),
+            _format(base['time_to_target'], '{:.2f}')) +
+            (' REGRESSION' if regressed else ''))
+    return regressions
+
+
+def main():
+    """Main entrypoint"""
+    args = parse_args()
+    max_iter = args.max_iter or MAX_ITER[args.solver]
+    settings = {
+        'solver': args.solver,
+        'time_limit': args.time_limit,
+        'max_iter': max_iter,
+        'seed': args.seed,
+        'target_gap': args.target_gap,
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        mismatches = settings_mismatches(settings, baseline)
+        if mismatches:
+            for key in mismatches:
+                print('! Baseline {key}: {b}, current: {c} !'.format(
+                    key=key, b=baseline.get(key), c=settings[key]))
+            print('! Results are not comparable to baseline !')
+            return 2
+    results = {}
+    for instance in args.instances:
+        for _ in range(max(args.repeats, 1)):
+            pool = multiprocessing.Pool(processes=1, maxtasksperchild=1)
+            try:
+                name, result = pool.apply(run_instance, (args.solver,
+                    instance, args.time_limit, max_iter, args.seed,
+                    args.target_gap))
+            finally:
+                pool.terminate()
+            if name not in results or result['evaluations_per_second'] > \
+                    results[name]['evaluations_per_second']:
+                results[name] = result
+    print_results(results)
+    report = dict(settings, instances=results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, sort_keys=True)
+    if baseline is not None:
+        if compare(results, baseline['instances'], args.tolerance,
+                args.min_seconds):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Convert QAP instance files to binary form
+
+Every instance is written to <output>/<instance name>/ as .npy matrices (int32,
+int64 if some value does not fit). Solvers accept such directories in place of
+instance files and memory-map them instead of parsing text. Default output
+directory is _converted/ next to this script, it is ignored by git. Exit code
+is non-zero if any instance could not be written
+"""
+
+import argparse
+import os
+import sys
+
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('.'):
+    from lib.problem_utils import Problem
+
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser("QAP instance converter")
+    parser.add_argument('instances',
+        nargs='+',
+        help='QAP problem instance(s)')
+    filedir = os.path.dirname(os.path.abspath(__file__))
+    parser.add_argument('--output',
+        help='Directory of converted instances (default: _converted next to '
+            'this script)',
+        default=os.path.join(filedir, '_converted'))
+    return parser.parse_args()
+
+
+def main():
+    """Main entrypoint"""
+    args = parse_args()
+    failed = 0
+    for instance in args.instances:
+        name = os.path.splitext(os.path.basename(instance))[0]
+        problem = Problem.from_file(instance, use_cache=False)
+        path = os.path.join(args.output, name)
+        try:
+            problem.save_binary(path)
+        except OSError as error:
+            print('! {name}: could not write {path}: {e} !'.format(
+                name=name, path=path, e=error))
+            failed += 1
+            continue
+        print('{name}: n = {n}, symmetric: {sym} -> {path}'.format(
+            name=name, n=problem.n, sym=problem.symmetric, path=path))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
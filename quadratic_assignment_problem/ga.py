@@ -4,10 +4,12 @@ GA solver for quadratic assignment problem
 """
 
 import argparse
+import multiprocessing
+import queue
 import time
 import os
 import sys
-from copy import deepcopy
+import numpy as np
 
 
 # local imports
@@ -25,11 +27,19 @@ def import_from(rel_path):
 with import_from('.'):
     import lib.search_utils as search
     from lib.problem_utils import Problem
+    from lib.problem_utils import Solution
     from lib.problem_utils import QapObjective
+    from lib.lower_bound import gilmore_lawler_bound
+    from lib.lower_bound import gap
     from lib.generate_output import generate_sol
     from lib.constraints import satisfies_constraints
 
 
+FITNESS_CACHE_SIZE = 100000  # max number of remembered fitness values
+ELITES = 2  # best individuals always kept in population
+MIGRATION_QUEUE_SIZE = 4  # migrations buffered towards an island
+
+
 def parse_args():
     """Parse command-line arguments"""
     parser = argparse.ArgumentParser("QAP problem parser")
@@ -47,6 +57,55 @@ def parse_args():
         help='Algorithm max iterations',
         type=int,
         default=1000)
+    parser.add_argument('--no-cache',
+        action='store_true',
+        help='Do not use on-disk cache of parsed instances')
+    parser.add_argument('--local-search',
+        action='store_true',
+        help='Improve offspring with best-improvement 2-exchange (memetic GA)')
+    parser.add_argument('--crossover',
+        help='Permutation cross-over operator: order (ox), partially mapped '
+            '(pmx), cycle (cx), uniform order-based (ux)',
+        choices=search.crossover_methods().keys(),
+        default='ox')
+    parser.add_argument('--stagnation',
+        help='Generations without improvement before restart (or stop when '
+            'no restarts left), 0: never',
+        type=int,
+        default=0)
+    parser.add_argument('--restarts',
+        help='Number of population restarts on stagnation (best individual '
+            'is kept)',
+        type=int,
+        default=0)
+    parser.add_argument('--max-evaluations',
+        help='Stop after this many objective evaluations (cache hits are '
+            'not counted)',
+        type=int,
+        default=None)
+    parser.add_argument('--target',
+        help='Stop as soon as objective value is not greater than target',
+        type=int,
+        default=None)
+    parser.add_argument('--gap',
+        help='Stop as soon as gap to Gilmore-Lawler lower bound (in percent) '
+            'is not greater than this value',
+        type=float,
+        default=None)
+    parser.add_argument('--islands',
+        help='Number of islands (sub-populations in separate processes), '
+            'island k uses k-th cross-over operator after the chosen one and '
+            '(1 + k mod 3)/n mutation rate',
+        type=int,
+        default=0)
+    parser.add_argument('--migration-interval',
+        help='Generations between migrations of elite individuals',
+        type=int,
+        default=10)
+    parser.add_argument('--migrants',
+        help='Number of elite individuals sent to the next island',
+        type=int,
+        default=2)
     parser.add_argument('--population',
         help='Maintained population size',
         type=int,
@@ -54,65 +113,254 @@ def parse_args():
     return parser.parse_args()
 
 
-def genetic_algorithm(problem, time_limit, max_iter):
-    """GA main entry point"""
+def _evolve(problem, O, fitness, P, scores, crossover, local_search,
+        mutation_rate=None):
+    """Produce next generation, return it with attached fitness"""
+    # operators return new arrays: parents are kept intact
+    parents = P
+    P = search.select(problem, fitness, P, scores)
+    P = search.reproduce(problem, P, crossover)
+    P = search.mutate(problem, P, mutation_rate)
+    if local_search:
+        P = np.array([search.local_search(problem, O, p) for p in P])
+    return search.replace(problem, fitness, parents, P, scores, ELITES)
+
+
+def _restart(problem, fitness, best_S):
+    """New random population keeping the best individual"""
+    P = search.create_initial_population(problem)
+    P[0] = best_S
+    return P, fitness.batch(problem, P)
+
+
+def genetic_algorithm(problem, time_limit, max_iter, local_search=False,
+        crossover='ox', stagnation=None, restarts=0, target=None,
+        lower_bound=None, max_gap=None, max_evaluations=None, seed=11,
+        stats=None):
+    """
+    GA main entry point
+
+    If stats dict is given, it is filled with number of objective evaluations,
+    seconds spent in search and trace of (seconds, best objective) pairs
+    recorded on improvements
+    """
     # O - objective function
     # S - current solution
     # best_S <=> S*
     # MD - method specific supplementary data
-    search.set_seed(11)
+    search.set_seed(seed)
     best_S = None
     O = QapObjective()
+    # fitness values of known permutations
+    fitness = search.FitnessCache(O, maxsize=FITNESS_CACHE_SIZE)
+    budget = search.Budget(time_limit, max_iter, stagnation, restarts, target,
+        lower_bound, max_gap, max_evaluations)
     P = search.create_initial_population(problem)
     for p in P:
         if not satisfies_constraints(problem, p):
             raise ValueError('initial solution is infeasible')
-    best_S = sorted([p for p in P], key=lambda x: O(problem, x))[0]
-    best_O = O(problem, best_S)
-
-    for i in range(max_iter):
-        if i % 100 == 0:
-            print('So far O* = {o}'.format(o=best_O))
-        parents = deepcopy(P)
-        P = search.select(problem, O, P)
-        P = search.reproduce(problem, P)
-        P = search.mutate(problem, P)
-        P = search.replace(problem, parents, P)
-        curr_best_S = sorted([p for p in P], key=lambda x: O(problem, x))[0]
-        curr_best_O = O(problem, curr_best_S)
-        if curr_best_O >= best_O:
+    # scores: fitness attached to each individual of P
+    scores = fitness.batch(problem, P)
+    best_S = P[int(np.argmin(scores))].copy()
+    best_O = int(scores.min())
+    trace = [(budget.elapsed, best_O)]
+
+    reason = None
+    while reason is None:
+        if budget.iterations % 100 == 0:
+            if lower_bound is None:
+                print('So far O* = {o}'.format(o=best_O))
+            else:
+                print('So far O* = {o} (gap {g:.2f}%)'.format(
+                    o=best_O, g=gap(best_O, lower_bound)))
+        P, scores = _evolve(problem, O, fitness, P, scores, crossover,
+            local_search)
+        if scores.min() < best_O:
+            best_S = P[int(np.argmin(scores))].copy()
+            best_O = int(scores.min())
+            trace.append((budget.elapsed, best_O))
+        budget.update(best_O)
+        if budget.should_restart():
+            P, scores = _restart(problem, fitness, best_S)
+        budget.charge(fitness.evaluations - budget.evaluations)
+        reason = budget.stop_reason()
+    if stats is not None:
+        stats['evaluations'] = fitness.evaluations
+        stats['seconds'] = budget.elapsed
+        stats['trace'] = trace
+    print('Stopped: {reason} after {g} generations ({r} restarts)'.format(
+        reason=reason, g=budget.iterations, r=budget.restarts))
+    print('Objective evaluations: {e} (cache hits: {h})'.format(
+        e=fitness.evaluations, h=fitness.hits))
+    return Solution(best_S.tolist())
+
+
+# island model
+def _migrate(problem, fitness, P, scores, migrants, inbox, outbox):
+    """
+    Send elite individuals to the next island, replace worst individuals
+    with everything received from the previous one so far
+
+    Never blocks: migrants are dropped if the next island does not keep up
+    (or has already finished)
+    """
+    try:
+        outbox.put_nowait(P[np.argsort(scores)[:migrants]])
+    except queue.Full:
+        pass
+    for arrived in _drain(inbox):
+        worst = np.argsort(scores)[len(scores)-len(arrived):]
+        P[worst] = arrived
+        scores[worst] = fitness.batch(problem, arrived)
+    return P, scores
+
+
+def _drain(inbox):
+    """Take all migrations currently waiting in inbox"""
+    arrived = []
+    while True:
+        try:
+            arrived.append(inbox.get_nowait())
+        except queue.Empty:
+            return arrived
+
+
+def _island(index, problem, seed, time_limit, max_iter, local_search,
+        crossover, mutation_rate, migration_interval, migrants, stagnation,
+        restarts, target, lower_bound, max_gap, max_evaluations, inbox, outbox,
+        results):
+    """Evolve single island (island process entry point)"""
+    search.set_seed(seed)
+    O = QapObjective()
+    fitness = search.FitnessCache(O, maxsize=FITNESS_CACHE_SIZE)
+    budget = search.Budget(time_limit, max_iter, stagnation, restarts, target,
+        lower_bound, max_gap, max_evaluations)
+    P = search.create_initial_population(problem)
+    scores = fitness.batch(problem, P)
+    best_S = P[int(np.argmin(scores))].copy()
+    best_O = int(scores.min())
+    reason = None
+    while reason is None:
+        P, scores = _evolve(problem, O, fitness, P, scores, crossover,
+            local_search, mutation_rate)
+        if budget.iterations % migration_interval == migration_interval - 1:
+            P, scores = _migrate(
+                problem, fitness, P, scores, migrants, inbox, outbox)
+        if scores.min() < best_O:
+            best_S = P[int(np.argmin(scores))].copy()
+            best_O = int(scores.min())
+        budget.update(best_O)
+        if budget.should_restart():
+            P, scores = _restart(problem, fitness, best_S)
+        budget.charge(fitness.evaluations - budget.evaluations)
+        reason = budget.stop_reason()
+    # unblock the previous island and do not wait for unread migrants on exit
+    _drain(inbox)
+    outbox.cancel_join_thread()
+    results.put((index, best_S, best_O, budget.iterations, fitness.evaluations,
+        reason))
+
+
+def island_model(problem, islands, time_limit, max_iter, local_search=False,
+        crossover='ox', migration_interval=10, migrants=2, stagnation=None,
+        restarts=0, target=None, lower_bound=None, max_gap=None,
+        max_evaluations=None, seed=11):
+    """
+    Island model GA main entry point
+
+    Every island evolves own population in a separate process with own
+    random stream. Elite individuals migrate over ring topology through
+    bounded queues every migration_interval generations, the master gathers
+    best individuals of all islands
+    """
+    seeds = np.random.SeedSequence(seed).spawn(islands)
+    operators = list(search.crossover_methods().keys())
+    first = operators.index(crossover)
+    operators = operators[first:] + operators[:first]
+    # inboxes[k]: migrants sent to island k by island k - 1
+    inboxes = [multiprocessing.Queue(maxsize=MIGRATION_QUEUE_SIZE)
+        for _ in range(islands)]
+    results = multiprocessing.Queue()
+    processes = []
+    for k in range(islands):
+        processes.append(multiprocessing.Process(target=_island, args=(
+            k, problem, seeds[k], time_limit, max_iter, local_search,
+            operators[k % len(operators)], (1 + k % 3) / problem.n,
+            migration_interval, migrants, stagnation, restarts, target,
+            lower_bound, max_gap, max_evaluations, inboxes[k],
+            inboxes[(k + 1) % islands],
+            results)))
+    for process in processes:
+        process.start()
+    gathered = sorted(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    for index, _, island_O, generations, evaluations, reason in gathered:
+        print('Island {k} ({op}): O* = {o}, stopped: {reason} after {g} '
+            'generations, evaluations: {e}'.format(k=index,
+                op=operators[index % len(operators)], o=island_O,
+                reason=reason, g=generations, e=evaluations))
+    best = min(gathered, key=lambda result: result[2])
+    return Solution(best[1].tolist())
+
+
+def _print_summary(summary):
+    """Print objective value and gap to lower bound of every instance"""
+    row = '{:<12} {:>12} {:>12} {:>8} {:>10}'
+    print(row.format('instance', 'O*', 'lower bound', 'gap,%', 'time,s'))
+    for name, objective_value, lower_bound, elapsed in summary:
+        if objective_value is None:
+            print(row.format(name, '-', lower_bound, '-', '-'))
             continue
-        best_S = curr_best_S
-        best_O = curr_best_O
-    return best_S
+        print(row.format(name, objective_value, lower_bound,
+            '{:.2f}'.format(gap(objective_value, lower_bound)),
+            '{:.1f}'.format(elapsed)))
 
 
 def main():
     """Main entrypoint"""
     args = parse_args()
     print(args.instances)
+    summary = []  # (instance name, O*, lower bound, seconds)
     for instance in args.instances:
         name = os.path.splitext(os.path.basename(instance))[0]
-        with open(instance, 'r') as instance_file:
-            problem = Problem(instance_file)
-            problem.population_size = args.population
+        problem = Problem.from_file(instance, use_cache=not args.no_cache)
+        problem.population_size = args.population
         print('-'*100)
         print('File: {name}.txt'.format(name=name))
+        lower_bound = gilmore_lawler_bound(problem)
+        print('Lower bound (Gilmore-Lawler) = {lb}'.format(lb=lower_bound))
         start = time.time()
-        S = genetic_algorithm(
-            problem, args.time_limit, args.max_iter)
+        if args.islands > 1:
+            S = island_model(problem, args.islands, args.time_limit,
+                args.max_iter, args.local_search, args.crossover,
+                args.migration_interval, args.migrants, args.stagnation,
+                args.restarts, args.target, lower_bound, args.gap,
+                args.max_evaluations)
+        else:
+            S = genetic_algorithm(
+                problem, args.time_limit, args.max_iter, args.local_search,
+                args.crossover, args.stagnation, args.restarts, args.target,
+                lower_bound, args.gap, args.max_evaluations)
         elapsed = time.time() - start
         if S is None:
             print('! NO SOLUTION FOUND !')
         else:
-            print('O* = {o}'.format(o=QapObjective()(problem, S)))
+            objective_value = QapObjective()(problem, S)
+            print('O* = {o}'.format(o=objective_value))
+            print('Gap to lower bound: {g:.2f}%'.format(
+                g=gap(objective_value, lower_bound)))
             print('All satisfied?', satisfies_constraints(problem, S))
             print('----- PERFORMANCE -----')
             print('GA took {some} seconds'.format(some=elapsed))
         print('-'*100)
+        summary.append((name, None if S is None else
+            QapObjective()(problem, S), lower_bound, elapsed))
         if S is not None and not args.no_sol:
             filedir = os.path.dirname(os.path.abspath(__file__))
             generate_sol(name, S, cwd=filedir)
+    if len(summary) > 1:
+        _print_summary(summary)
     return 0
 
 
@@ -1,9 +1,9 @@
 import os
 
 
-def generate_sol(name, solution, cwd):
-    """Generate <instance name>.sol"""
-    filename = '{name}.sol'.format(name=name)
+def generate_sol(name, solution, cwd, prefix=''):
+    """Generate <prefix><instance name>.sol"""
+    filename = '{prefix}{name}.sol'.format(prefix=prefix, name=name)
     filepath = os.path.join(os.path.abspath(cwd), '_results')
     try:
         os.makedirs(filepath)
@@ -0,0 +1,88 @@
+"""
+Lower bounds for quadratic assignment problem
+"""
+import numpy as np
+
+
+def _off_diagonal(matrix):
+    """Rows of square matrix without diagonal elements"""
+    n = len(matrix)
+    return matrix[~np.eye(n, dtype=bool)].reshape(n, n - 1)
+
+
+def linear_assignment(cost):
+    """
+    Solve linear assignment problem (Hungarian method with shortest
+    augmenting paths, O(n^3))
+
+    Return array of columns assigned to rows and total cost
+    """
+    cost = np.asarray(cost)
+    n = len(cost)
+    c = cost.astype(np.float64)
+    # potentials and matching are 1-based, column 0 is a virtual root
+    u = np.zeros(n + 1)
+    v = np.zeros(n + 1)
+    row_of = np.zeros(n + 1, dtype=np.int64)  # row matched to column
+    for row in range(1, n + 1):
+        row_of[0] = row
+        j0 = 0
+        min_slack = np.full(n + 1, np.inf)
+        way = np.zeros(n + 1, dtype=np.int64)
+        used = np.zeros(n + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = row_of[j0]
+            free = ~used
+            free[0] = False
+            slack = c[i0 - 1] - u[i0] - v[1:]
+            better = free[1:] & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = j0
+            candidates = np.where(free, min_slack, np.inf)
+            j1 = int(np.argmin(candidates))
+            delta = candidates[j1]
+            u[row_of[used]] += delta
+            v[used] -= delta
+            min_slack[free] -= delta
+            j0 = j1
+            if row_of[j0] == 0:
+                break
+        # augment along the alternating path
+        while j0:
+            j1 = way[j0]
+            row_of[j0] = row_of[j1]
+            j0 = j1
+    assignment = np.empty(n, dtype=np.int64)
+    assignment[row_of[1:] - 1] = np.arange(n)
+    return assignment, cost[np.arange(n), assignment].sum()
+
+
+def gilmore_lawler_costs(problem):
+    """
+    Cost of placing facility i to location k in Gilmore-Lawler bound
+
+    Diagonal product plus minimal scalar product of off-diagonal flows of i
+    (ascending) and distances of k (descending)
+    """
+    F = np.asarray(problem.flows, dtype=np.int64)
+    D = np.asarray(problem.distances, dtype=np.int64)
+    flows = np.sort(_off_diagonal(F), axis=1)
+    distances = -np.sort(-_off_diagonal(D), axis=1)
+    return np.outer(np.diag(F), np.diag(D)) + flows @ distances.T
+
+
+def gilmore_lawler_bound(problem):
+    """Gilmore-Lawler lower bound of objective value"""
+    if problem.n < 2:
+        return int(np.einsum('ij,ij->', problem.flows, problem.distances,
+            dtype=np.int64))
+    _, bound = linear_assignment(gilmore_lawler_costs(problem))
+    return int(bound)
+
+
+def gap(objective_value, lower_bound):
+    """Relative gap (in percent) between objective value and lower bound"""
+    if lower_bound <= 0:
+        return float('inf') if objective_value > lower_bound else 0.0
+    return 100.0 * (objective_value - lower_bound) / lower_bound
@@ -1,6 +1,25 @@
 """Problem utilities"""
 from copy import copy as shallowcopy
 from decimal import Decimal
+import os
+import unittest
+import numpy as np
+
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('../../common'):
+    import instance_cache
 
 
 class Solution(object):
@@ -29,21 +48,111 @@ class Solution(object):
         return len(self._locations)
 
 
+PARSE_CHUNK_SIZE = 1 << 20  # characters of instance file parsed at once
+BATCH_MEMORY = 32 << 20  # bytes of permuted distances per batch chunk
+
+
+def _matrix_values(values):
+    """
+    Matrix values as int32 array, int64 if some value does not fit int32
+
+    int32 arrays are returned as is, so memory-mapped ones stay mapped
+    """
+    values = np.asarray(values)
+    if values.dtype == np.int32:
+        return values
+    try:
+        values = np.asarray(values, dtype=np.int64)
+    except OverflowError:
+        raise ValueError('QAP matrix value does not fit int64')
+    limits = np.iinfo(np.int32)
+    if values.size and (values.min() < limits.min or
+            values.max() > limits.max):
+        return values
+    return values.astype(np.int32)
+
+
 class Problem(object):
-    """Problem utility class"""
+    """
+    Problem utility class
+
+    Distance and flow matrices are stored as int32 arrays (possibly
+    memory-mapped), int64 if some value does not fit int32. QapObjective
+    casts factors to int64 before multiplying
+    """
     def __init__(self, io_stream):
-        self._n, self._distances, self._flows = Problem.parse_instance(
-            io_stream)
+        self._init(*Problem.parse_instance(io_stream))
+
+    def _init(self, n, distances, flows):
+        """Init from parsed matrices"""
+        self._n = n
+        self._distances = distances
+        self._flows = flows
+        self._symmetric = None
         self.population_size = 0  # maintained population size
 
+    @classmethod
+    def from_arrays(cls, distances, flows):
+        """Construct problem from distance and flow matrices"""
+        problem = cls.__new__(cls)
+        problem._init(len(distances), _matrix_values(distances),
+            _matrix_values(flows))
+        return problem
+
+    @classmethod
+    def from_binary(cls, path):
+        """
+        Construct problem from directory with pre-converted distances.npy
+        and flows.npy (see save_binary), matrices are memory-mapped
+        """
+        arrays = instance_cache.load(path, ['distances', 'flows'])
+        if arrays is None:
+            raise ValueError('no converted instance in {p}'.format(p=path))
+        return cls.from_arrays(arrays['distances'], arrays['flows'])
+
+    def save_binary(self, path, ignore_errors=False):
+        """
+        Save matrices to directory loadable by from_binary
+
+        Raises OSError if matrices could not be written, unless ignore_errors
+        is set
+        """
+        instance_cache.save(path, {
+            'distances': self.distances,
+            'flows': self.flows}, ignore_errors)
+
+    @classmethod
+    def from_file(cls, instance_path, use_cache=True):
+        """
+        Construct problem from instance file or directory with converted
+        instance
+
+        Parsed matrices are cached on disk next to the instance and
+        memory-mapped on next load
+        """
+        if os.path.isdir(instance_path):
+            return cls.from_binary(instance_path)
+        if not use_cache:
+            with open(instance_path, 'r') as instance_file:
+                return cls(instance_file)
+        path = instance_cache.cache_path(instance_path)
+        arrays = instance_cache.load(path, ['distances', 'flows'])
+        if arrays is None or arrays['distances'].dtype not in (np.int32,
+                np.int64):
+            with open(instance_path, 'r') as instance_file:
+                problem = cls(instance_file)
+            problem.save_binary(path, ignore_errors=True)
+            return problem
+        return cls.from_arrays(arrays['distances'], arrays['flows'])
+
     @property
     def distances(self):
-        """Return distances matrix"""
+        """Return distances matrix (n x n ndarray)"""
         return self._distances
 
     @property
     def flows(self):
-        """Return flow matrix"""
+        """Return flow matrix (n x n ndarray)"""
         return self._flows
 
     @property
@@ -51,28 +160,60 @@ class Problem(object):
         """Get number of plants/locations"""
         return self._n
 
+    @property
+    def symmetric(self):
+        """Check whether both distance and flow matrices are symmetric"""
+        if self._symmetric is None:
+            self._symmetric = bool(
+                np.array_equal(self._distances, self._distances.T) and
+                np.array_equal(self._flows, self._flows.T))
+        return self._symmetric
+
     @staticmethod
     def parse_instance(io_stream):
-        """Parse QAP instance file"""
+        """
+        Parse QAP instance file
+
+        Values are streamed in chunks into single int64 buffer, so only
+        one chunk of per-value Python objects is alive at a time. Matrices
+        are downcast to int32 when every value fits
+        """
         n = int(io_stream.readline().strip())
-        # read distances matrix:
-        distances = []
-        row = io_stream.readline().strip()
-        while row:
-            data_row = [int(v) for v in row.split()]
-            distances.append(data_row)
-            row = io_stream.readline().strip()
-        # read flows matrix:
-        flows = []
-        for row in io_stream.readlines():
-            row = row.strip()
-            if not row:
-                continue
-            data_row = [int(v) for v in row.split()]
-            flows.append(data_row)
+        values = np.empty(2 * n * n, dtype=np.int64)
+        filled = 0
+        tail = ''
+        while True:
+            chunk = io_stream.read(PARSE_CHUNK_SIZE)
+            text = tail + chunk
+            tail = ''
+            if chunk and not text[-1].isspace():
+                # last number may continue in the next chunk
+                cut = max(text.rfind(' '), text.rfind('\n'), text.rfind('\t'))
+                text, tail = text[:cut + 1], text[cut + 1:]
+            try:
+                parsed = np.array(text.split(), dtype=np.int64)
+            except OverflowError:
+                raise ValueError('QAP instance value does not fit int64')
+            if filled + len(parsed) > len(values):
+                raise ValueError('too many values in QAP instance')
+            values[filled:filled + len(parsed)] = parsed
+            filled += len(parsed)
+            if not chunk:
+                break
+        if filled != len(values):
+            raise ValueError('expected {e} values in QAP instance, got '
+                '{g}'.format(e=len(values), g=filled))
+        distances, flows = _matrix_values(values).reshape(2, n, n)
         return n, distances, flows
 
 
+def _locations(solution):
+    """Facility -> location assignment of solution as ndarray"""
+    if isinstance(solution, Solution):
+        solution = solution._locations
+    return np.asarray(solution, dtype=np.intp)
+
+
 class QapObjective():
     """Quadratic assignment problem objective function"""
     def __call__(self, problem, solution):
@@ -85,9 +226,231 @@ class QapObjective():
         :param solution:
             Solution object
         """
-        distance = lambda i, j: problem.distances[i][j]
-        obj = 0
-        for i in range(problem.n):
-            for j in range(problem.n):
-                obj += problem.flows[i][j] * distance(solution[i], solution[j])
-        return obj
+        p = _locations(solution)
+        return int(np.einsum('ij,ij->', problem.flows,
+            problem.distances[p][:, p], dtype=np.int64))
+
+    def batch(self, problem, solutions):
+        """
+        Calculate objective function values for many solutions at once
+
+        Permuted distance matrices are gathered for chunks of rows, so that
+        they (with their int64 copy made by einsum) take at most BATCH_MEMORY
+        bytes, at least one row is evaluated per chunk
+
+        :param problem:
+            Problem object
+        :param solutions:
+            2-D array of permutations (one per row) or sequence of solutions
+        """
+        if isinstance(solutions, np.ndarray):
+            p = solutions.astype(np.intp, copy=False)
+        else:
+            p = np.array([_locations(s) for s in solutions], dtype=np.intp)
+        p = p.reshape(-1, problem.n)
+        values = np.empty(len(p), dtype=np.int64)
+        row_bytes = (problem.distances.itemsize + 8) * problem.n * problem.n
+        step = max(1, BATCH_MEMORY // max(row_bytes, 1))
+        for start in range(0, len(p), step):
+            chunk = p[start:start + step]
+            distances = problem.distances[chunk[:, :, None], chunk[:, None, :]]
+            values[start:start + step] = np.einsum('ij,kij->k', problem.flows,
+                distances, dtype=np.int64)
+        return values
+
+    def swap_delta(self, problem, solution, r, s):
+        """
+        Objective change of swapping locations of facilities r and s, O(n)
+        """
+        p = _locations(solution)
+        F, D = problem.flows, problem.distances
+        pr, ps = p[r], p[s]
+        delta = (int(F[r, r]) - int(F[s, s])) * \
+            (int(D[ps, ps]) - int(D[pr, pr]))
+        # factors are cast to int64 before multiplication: int32 matrices
+        terms = (F[:, r].astype(np.int64) - F[:, s]) * \
+            (D[p, ps].astype(np.int64) - D[p, pr])
+        if problem.symmetric:
+            # row and column contributions are equal
+            terms *= 2
+        else:
+            delta += (int(F[r, s]) - int(F[s, r])) * \
+                (int(D[ps, pr]) - int(D[pr, ps]))
+            terms += (F[r, :].astype(np.int64) - F[s, :]) * \
+                (D[ps, p].astype(np.int64) - D[pr, p])
+        return int(delta + terms.sum() - terms[r] - terms[s])
+
+    def swap_delta_batch(self, problem, permutations, r, s):
+        """
+        Objective changes of swapping facilities r[i] and s[i] in every row
+        i of 2-D permutations array, O(n) per row
+        """
+        F, D = problem.flows, problem.distances
+        rows = np.arange(len(permutations))
+        pr, ps = permutations[rows, r], permutations[rows, s]
+        delta = (F[r, r].astype(np.int64) - F[s, s]) * \
+            (D[ps, ps].astype(np.int64) - D[pr, pr])
+        # factors are cast to int64 before multiplication: int32 matrices
+        terms = (F[:, r].T.astype(np.int64) - F[:, s].T) * \
+            (D[permutations, ps[:, None]].astype(np.int64) -
+                D[permutations, pr[:, None]])
+        if problem.symmetric:
+            # row and column contributions are equal
+            terms *= 2
+        else:
+            delta += (F[r, s].astype(np.int64) - F[s, r]) * \
+                (D[ps, pr].astype(np.int64) - D[pr, ps])
+            terms += (F[r].astype(np.int64) - F[s]) * \
+                (D[ps[:, None], permutations].astype(np.int64) -
+                    D[pr[:, None], permutations])
+        return delta + terms.sum(axis=1) - terms[rows, r] - terms[rows, s]
+
+    def _swap_delta_row(self, problem, Dp, r):
+        """
+        Swap deltas of facility r with every facility, O(n^2)
+
+        Dp is int64 distance matrix permuted by solution
+        """
+        F = problem.flows
+        # terms[s, k]: contribution of facility k to delta of swap (r, s)
+        terms = ((F[:, r].astype(np.int64)[:, None] - F) *
+            (Dp - Dp[:, r][:, None])).T
+        if problem.symmetric:
+            terms = 2 * terms
+        else:
+            terms = terms + (F[r].astype(np.int64)[None, :] - F) * \
+                (Dp - Dp[r][None, :])
+        row = terms.sum(axis=1) - terms[:, r] - np.diagonal(terms)
+        row += (F[r, r].astype(np.int64) - np.diagonal(F)) * \
+            (np.diagonal(Dp) - Dp[r, r])
+        if not problem.symmetric:
+            row += (F[r, :].astype(np.int64) - F[:, r]) * \
+                (Dp[:, r] - Dp[r, :])
+        row[r] = 0
+        return row
+
+    def swap_deltas(self, problem, solution):
+        """
+        Matrix of objective changes of swapping every pair of facilities
+
+        Computed once in O(n^3), then maintained by update_swap_deltas
+        """
+        p = _locations(solution)
+        Dp = problem.distances[p][:, p].astype(np.int64)
+        return np.array(
+            [self._swap_delta_row(problem, Dp, r) for r in range(problem.n)])
+
+    def update_swap_deltas(self, problem, solution, deltas, r, s):
+        """
+        Update swap deltas in-place in O(n^2) after facilities r and s have
+        been swapped in solution (Taillard's formula)
+        """
+        p = _locations(solution)
+        F, D = problem.flows, problem.distances
+        a = (F[r, :] - F[s, :]).astype(np.int64)
+        b = (D[p[s], p] - D[p[r], p]).astype(np.int64)
+        if problem.symmetric:
+            # second term equals the first one
+            deltas += 2 * (a[:, None] - a[None, :]) * (b[:, None] - b[None, :])
+        else:
+            c = (F[:, r] - F[:, s]).astype(np.int64)
+            e = (D[p, p[s]] - D[p, p[r]]).astype(np.int64)
+            deltas += (a[:, None] - a[None, :]) * (b[:, None] - b[None, :])
+            deltas += (c[:, None] - c[None, :]) * (e[:, None] - e[None, :])
+        # pairs with r or s are recomputed from scratch
+        Dp = D[p][:, p].astype(np.int64)
+        for t in (r, s):
+            row = self._swap_delta_row(problem, Dp, t)
+            deltas[t, :] = row
+            deltas[:, t] = row
+        return deltas
+
+
+class QapObjectiveTests(unittest.TestCase):
+    """Unit Tests for QAP objective"""
+
+    def setUp(self):
+        super(QapObjectiveTests, self).setUp()
+        rng = np.random.default_rng(0)
+        n = 12
+        # products of such entries do not fit into int32
+        flows = rng.integers(100000, 200000, size=(n, n))
+        distances = rng.integers(100000, 200000, size=(n, n))
+        self.problems = [
+            Problem.from_arrays(distances, flows),
+            Problem.from_arrays(distances + distances.T, flows + flows.T)]
+        self.permutations = np.array([rng.permutation(n) for _ in range(8)])
+
+    @staticmethod
+    def _objective(problem, p):
+        """Reference objective with Python integers"""
+        return sum(int(problem.flows[i, j]) * int(problem.distances[p[i], p[j]])
+            for i in range(problem.n) for j in range(problem.n))
+
+    @staticmethod
+    def _swapped(p, r, s):
+        """Copy of permutation with r-th and s-th elements swapped"""
+        p = p.copy()
+        p[r], p[s] = p[s], p[r]
+        return p
+
+    def test_objective_does_not_overflow(self):
+        O = QapObjective()
+        for problem in self.problems:
+            expected = [QapObjectiveTests._objective(problem, p)
+                for p in self.permutations]
+            self.assertEqual(expected,
+                [O(problem, Solution(p.tolist())) for p in self.permutations])
+            self.assertEqual(expected,
+                O.batch(problem, self.permutations).tolist())
+
+    def test_batch_is_evaluated_in_chunks(self):
+        from unittest import mock
+        O = QapObjective()
+        problem = self.problems[0]
+        expected = O.batch(problem, self.permutations).tolist()
+        row_bytes = problem.distances.nbytes
+        for memory in (1, row_bytes, 3 * row_bytes):
+            with mock.patch.dict(globals(), BATCH_MEMORY=memory):
+                self.assertEqual(expected,
+                    O.batch(problem, self.permutations).tolist())
+
+    def test_swap_deltas_match_objective(self):
+        O = QapObjective()
+        for problem in self.problems:
+            n = problem.n
+            r = np.arange(len(self.permutations)) % n
+            s = (r + 3) % n
+            batch = O.swap_delta_batch(problem, self.permutations, r, s)
+            for p, ri, si, delta in zip(self.permutations, r, s, batch):
+                expected = O(problem, QapObjectiveTests._swapped(p, ri, si)) - \
+                    O(problem, p)
+                self.assertEqual(expected, O.swap_delta(problem, p, ri, si))
+                self.assertEqual(expected, delta)
+            p = self.permutations[0].copy()
+            deltas = O.swap_deltas(problem, p)
+            p[1], p[5] = p[5], p[1]
+            O.update_swap_deltas(problem, p, deltas, 1, 5)
+            for ri in range(n):
+                for si in range(ri + 1, n):
+                    expected = O(problem,
+                        QapObjectiveTests._swapped(p, ri, si)) - O(problem, p)
+                    self.assertEqual(expected, deltas[ri, si])
+
+    def test_parse_keeps_values_beyond_int32(self):
+        from io import StringIO
+        problem = Problem(StringIO('1\n3000000000\n\n-2\n'))
+        self.assertEqual(np.int64, problem.distances.dtype)
+        self.assertEqual([[3000000000]], problem.distances.tolist())
+        self.assertEqual([[-2]], problem.flows.tolist())
+        self.assertEqual(-6000000000, QapObjective()(problem, Solution([0])))
+        problem = Problem(StringIO('1\n3\n\n-2\n'))
+        self.assertEqual(np.int32, problem.distances.dtype)
+        problem = Problem.from_arrays([[1 << 40]], [[1]])
+        self.assertEqual([[1 << 40]], problem.distances.tolist())
+        with self.assertRaises(ValueError):
+            Problem(StringIO('1\n{v}\n\n1\n'.format(v=1 << 70)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,10 +3,13 @@ Search utilities
 """
 import concurrent.futures as futures
 import multiprocessing
-from copy import deepcopy
+import hashlib
+import heapq
+import time
 from collections import namedtuple
+from collections import OrderedDict
 import numpy as np
-import random
+import unittest
 
 
 # local imports
@@ -23,94 +26,524 @@ def import_from(rel_path):
 
 with import_from('.'):
     from constraints import satisfies_constraints
-    from problem_utils import Solution
+    from problem_utils import Problem
+    from problem_utils import QapObjective
+    from lower_bound import gap
+
+
+_RNG = np.random.default_rng()  # random number generator of GA operators
 
 
 def set_seed(seed):
-    """Seed the numpy random number generator"""
-    np.random.seed(seed)
+    """Seed the random number generator of GA operators"""
+    global _RNG
+    _RNG = np.random.default_rng(seed)
+
+
+# budget
+class Budget(object):
+    """
+    Stopping rules of search
+
+    Search stops on wall-clock deadline, iteration limit, limit of charged
+    objective evaluations, reached target objective, gap to lower bound (in
+    percent) below max_gap or stagnation (no improvement of the best
+    objective for given number of iterations) once all stagnation restarts
+    are used up
+    """
+    def __init__(self, time_limit=None, max_iter=None, stagnation=None,
+            restarts=0, target=None, lower_bound=None, max_gap=None,
+            max_evaluations=None):
+        """Init method"""
+        self._time_limit = time_limit
+        self._max_iter = max_iter
+        self._max_evaluations = max_evaluations
+        self._stagnation = stagnation
+        self._target = target
+        self._lower_bound = lower_bound
+        self._max_gap = max_gap
+        self.restarts_left = restarts
+        self.iterations = 0
+        self.evaluations = 0  # charged objective evaluations
+        self.restarts = 0
+        self._stall = 0
+        self._best = None
+        self._start = time.time()
+
+    @property
+    def elapsed(self):
+        """Seconds since the budget was created"""
+        return time.time() - self._start
+
+    def update(self, best_objective):
+        """Record finished iteration with current best objective value"""
+        self.iterations += 1
+        if self._best is None or best_objective < self._best:
+            self._best = best_objective
+            self._stall = 0
+        else:
+            self._stall += 1
+
+    def charge(self, evaluations):
+        """Record objective evaluations spent by search"""
+        self.evaluations += evaluations
+
+    def _stagnated(self):
+        """Check whether best objective has not improved for too long"""
+        return bool(self._stagnation) and self._stall >= self._stagnation
+
+    def should_restart(self):
+        """Check (and consume) stagnation restart"""
+        if not self._stagnated() or self.restarts_left <= 0:
+            return False
+        self.restarts_left -= 1
+        self.restarts += 1
+        self._stall = 0
+        return True
+
+    def stop_reason(self):
+        """Return reason to stop the search or None to continue"""
+        if self._target is not None and self._best is not None and \
+                self._best <= self._target:
+            return 'target reached'
+        if self._max_gap is not None and self._lower_bound is not None and \
+                self._best is not None and \
+                gap(self._best, self._lower_bound) <= self._max_gap:
+            return 'gap reached'
+        if self._max_iter is not None and self.iterations >= self._max_iter:
+            return 'max iterations'
+        if self._max_evaluations is not None and \
+                self.evaluations >= self._max_evaluations:
+            return 'max evaluations'
+        if self._time_limit is not None and self.elapsed > self._time_limit:
+            return 'time limit'
+        if self._stagnated() and self.restarts_left <= 0:
+            return 'stagnation'
+        return None
+
+
+# fitness
+def permutation_key(permutation):
+    """Byte digest of permutation"""
+    permutation = np.ascontiguousarray(permutation, dtype=np.int32)
+    return hashlib.blake2b(permutation.tobytes(), digest_size=16).digest()
+
+
+class FitnessCache(object):
+    """
+    Bounded LRU table of objective values keyed by permutation digest
+
+    Exposes the same batch interface as QapObjective, only permutations
+    missing in the table are evaluated (once per batch if repeated)
+    """
+    def __init__(self, objective, maxsize=100000):
+        """Init method"""
+        self._objective = objective
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self.evaluations = 0  # number of actually evaluated permutations
+        self.hits = 0
+
+    def __call__(self, problem, solution):
+        """Objective value of single solution"""
+        return int(self.batch(problem, np.asarray([solution]))[0])
+
+    def batch(self, problem, solutions):
+        """Objective values of 2-D array of permutations"""
+        keys = [permutation_key(p) for p in solutions]
+        values = np.empty(len(keys), dtype=np.int64)
+        missing = OrderedDict()  # key -> indices of its permutations
+        for i, key in enumerate(keys):
+            value = self._entries.get(key)
+            if value is None:
+                missing.setdefault(key, []).append(i)
+                continue
+            self._entries.move_to_end(key)
+            values[i] = value
+        self.hits += len(keys) - len(missing)
+        if missing:
+            first = [indices[0] for indices in missing.values()]
+            evaluated = self._objective.batch(
+                problem, np.asarray(solutions)[first])
+            self.evaluations += len(first)
+            for (key, indices), value in zip(missing.items(), evaluated):
+                values[indices] = value
+                self._entries[key] = int(value)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        return values
 
 
 # initial
+def _random_permutations(size, n):
+    """(size x n) int32 array of random permutations"""
+    keys = _RNG.random((size, n))
+    return np.argsort(keys, axis=1).astype(np.int32)
+
+
 def create_initial_population(problem):
-    """Create initial population"""
-    population = []
-    for _ in range(problem.population_size * 2):
-        population.append(Solution(list(np.random.permutation(
-            range(problem.n)))))
-    return population
+    """
+    Create initial population
+
+    Population is a (size x n) int32 array, one permutation per row
+    """
+    return _random_permutations(problem.population_size * 2, problem.n)
 
 
 # selection
-def select(problem, objective, population):
-    """Select best individuals in population"""
-    probabilities = [objective(problem, i) for i in population]
-    total_fitness = sum(probabilities)
-    probabilities = [f / total_fitness for f in probabilities]
-    selected = []
-    indices = np.random.choice([i for i in range(len(population))],
-        replace=False, p=probabilities, size=int(len(population) / 2))
-    for i in indices:
-        selected.append(population[i])
-    return selected
+def select(problem, objective, population, fitness=None):
+    """
+    Select best individuals in population (returns new array)
+
+    Note: fitness of population is evaluated unless given
+    """
+    if fitness is None:
+        fitness = objective.batch(problem, population)
+    probabilities = fitness / fitness.sum()
+    indices = _RNG.choice(len(population), replace=False,
+        p=probabilities, size=int(len(population) / 2))
+    return population[indices]
 
 
 # cross-over
-def reproduce(problem, parents):
-    """Apply two point cross-over on parents"""
-    if len(parents) % 2 != 0:
-        raise ValueError('parents number is not even')
-    n = problem.n
-    # shuffle parents
-    np.random.shuffle(parents)
-    # for each pair of parents:
-    # child 1: fix "center", reverse "corners"
-    # child 2: reverse "center", fix "corners"
-    # => 1 parent produces 2 children
-    children = []
-    for p in parents:
-        first, second = np.random.choice([i for i in range(1, n)], size=2,
-            replace=False)
-        if first >= second:
-            first, second = second, first
-        reversed_p = list(reversed(p))
-        children.append(
-            reversed_p[:first] + p[first:second] + reversed_p[second:])
-        children.append(
-            p[:first] + reversed_p[first:second] + p[second:])
+# operators take (m x n) arrays of first and second parents and return
+# (m x n) array of children, one per pair, all children are permutations
+def _cut_points(m, n):
+    """Random segment [first, second) per row, 0 <= first < second <= n"""
+    points = np.sort(_RNG.integers(0, n + 1, size=(m, 2)), axis=1)
+    points[:, 1] += points[:, 0] == points[:, 1]
+    points[:, 0] -= points[:, 1] > n
+    points[:, 1] = np.minimum(points[:, 1], n)
+    return points[:, :1], points[:, 1:]
+
+
+def _fill_in_order(kept, first, second):
+    """
+    Keep genes of first parent where kept is set, fill other positions with
+    missing genes in order of second parent
+    """
+    m, n = first.shape
+    rows = np.arange(m)[:, None]
+    member = np.zeros((m, n), dtype=bool)
+    kept_rows, kept_positions = np.nonzero(kept)
+    member[kept_rows, first[kept_rows, kept_positions]] = True
+    children = np.where(kept, first, 0).astype(first.dtype)
+    # row-major order: per row, free positions and fill genes line up
+    free_rows, free_positions = np.nonzero(~kept)
+    children[free_rows, free_positions] = second[~member[rows, second]]
+    return children
+
+
+def _order_crossover(first, second):
+    """
+    OX: keep segment of first parent, fill the rest with genes of second
+    parent in order starting after the segment
+    """
+    m, n = first.shape
+    rows = np.arange(m)[:, None]
+    start, end = _cut_points(m, n)
+    genes = np.arange(n)[None, :]
+    segment = (genes >= start) & (genes < end)
+    # rotate positions so that filling starts right after the segment
+    rotation = (end + genes) % n
+    children = _fill_in_order(segment[rows, rotation], first[rows, rotation],
+        second[rows, rotation])
+    result = np.empty_like(children)
+    result[rows, rotation] = children
+    return result
+
+
+def _partially_mapped_crossover(first, second):
+    """
+    PMX: keep segment of first parent, take the rest from second parent
+    resolving conflicts through the segment mapping
+    """
+    m, n = first.shape
+    rows = np.arange(m)[:, None]
+    start, end = _cut_points(m, n)
+    genes = np.arange(n)[None, :]
+    segment = (genes >= start) & (genes < end)
+    # mapping[gene]: first[k] -> second[k] for segment positions k
+    mapping = np.repeat(genes, m, axis=0)
+    in_segment = np.zeros((m, n), dtype=bool)
+    seg_rows, seg_positions = np.nonzero(segment)
+    mapping[seg_rows, first[seg_rows, seg_positions]] = \
+        second[seg_rows, seg_positions]
+    in_segment[seg_rows, first[seg_rows, seg_positions]] = True
+    children = np.where(segment, first, second)
+    conflicts = ~segment & in_segment[rows, children]
+    while conflicts.any():
+        children = np.where(conflicts, mapping[rows, children], children)
+        conflicts = ~segment & in_segment[rows, children]
+    return children
+
+
+def _cycle_crossover(first, second):
+    """CX: take odd cycles from first parent, even cycles from second one"""
+    m, n = first.shape
+    rows = np.arange(m)[:, None]
+    position = np.empty_like(first)
+    position[rows, first] = np.arange(n)[None, :]
+    # next position in cycle, cycles are labelled with minimal position
+    successor = position[rows, second]
+    labels = np.repeat(np.arange(n)[None, :], m, axis=0)
+    for _ in range(int(np.ceil(np.log2(max(n, 2)))) + 1):
+        labels = np.minimum(labels, labels[rows, successor])
+        successor = successor[rows, successor]
+    is_start = labels == np.arange(n)[None, :]
+    rank = np.cumsum(is_start, axis=1) - 1
+    odd = rank[rows, labels] % 2 == 0
+    return np.where(odd, first, second)
+
+
+def _uniform_crossover(first, second):
+    """
+    UX: keep genes of first parent on random positions, fill the rest with
+    genes of second parent in order
+    """
+    kept = _RNG.random(first.shape) < 0.5
+    return _fill_in_order(kept, first, second)
+
+
+def crossover_methods():
+    """Return available permutation cross-over operators"""
+    return {
+        'ox': _order_crossover,
+        'pmx': _partially_mapped_crossover,
+        'cx': _cycle_crossover,
+        'ux': _uniform_crossover
+    }
+
+
+def reproduce(problem, parents, crossover='ox'):
+    """
+    Apply cross-over on parents (returns new array)
+
+    Shuffled parents are paired with their next neighbour (cyclically), each
+    pair produces two children
+    """
+    method = crossover_methods()[crossover]
+    first = parents[_RNG.permutation(len(parents))]
+    second = np.roll(first, -1, axis=0)
+    children = np.empty((2 * len(parents), problem.n), dtype=parents.dtype)
+    children[0::2] = method(first, second)
+    children[1::2] = method(second, first)
     return children
 
 
 # mutation
-def mutate(problem, population):
-    """Mutate the population"""
-    prob = 1 / problem.n  # mutation probability for gene
-    # for each individual: find two indices, swap values at the indices
-    for i, individual in enumerate(population):
-        mutation_indices = []
-        for gene_id in range(problem.n):
-            if np.random.choice([True, False], size=1, p=[prob, 1 - prob]):
-                mutation_indices.append(gene_id)
-            if len(mutation_indices) == 2:
-                break
-        if len(mutation_indices) == 2:
-            k, r = mutation_indices[0], mutation_indices[1]
-            individual[k], individual[r] = individual[r], individual[k]
-            population[i] = individual
+def mutate(problem, population, rate=None):
+    """
+    Mutate the population in-place
+
+    Every gene is picked with probability rate (1/n by default, single bulk
+    draw for the whole population), the first two picked genes of an
+    individual are swapped
+    """
+    # mutation probability for gene, rate=0 turns mutation off
+    prob = 1 / problem.n if rate is None else rate
+    picked = np.cumsum(_RNG.random(population.shape) < prob, axis=1)
+    rows = np.flatnonzero(picked[:, -1] >= 2)
+    first = np.argmax(picked[rows] >= 1, axis=1)
+    second = np.argmax(picked[rows] >= 2, axis=1)
+    population[rows, first], population[rows, second] = \
+        population[rows, second], population[rows, first]
     return population
 
 
+# local search
+def local_search(problem, objective, solution):
+    """
+    Apply best-improvement 2-exchange until no swap improves the solution
+
+    Swap deltas are computed once and updated in O(n^2) per applied swap
+    """
+    p = np.array(solution, dtype=np.intp)
+    deltas = objective.swap_deltas(problem, p)
+    while True:
+        r, s = np.unravel_index(np.argmin(deltas), deltas.shape)
+        if deltas[r, s] >= 0:
+            break
+        p[r], p[s] = p[s], p[r]
+        objective.update_swap_deltas(problem, p, deltas, r, s)
+    return p.astype(np.int32)
+
+
 # replacement
-def replace(problem, parents, children):
-    """Apply steady-state-no-duplicates replacement
-
-    Can potentially result in delete-all strategy if N becomes equal to a number
-    of maintained population
-    """
-    # n = np.random.randint(len(parents) / 3, len(parents))
-    # indices = np.random.choice([i for i in range(len(parents))], size=n,
-    #     replace=False)
-    # for i in indices:
-    #     parents[i] = children[i]
-    # return parents
-    return children
+def replace(problem, fitness, parents, children, parent_scores=None,
+        elites=2):
+    """
+    Apply elitist no-duplicates replacement
+
+    The best distinct parents (elites) are kept, the rest of the population
+    is filled with the best children taken from a heap ordered by cached
+    fitness, a child is skipped if the same permutation is already present.
+    If there are not enough distinct children, the best remaining parents
+    are used and then random permutations, so the population size never
+    changes. Return new population with its fitness
+    """
+    if parent_scores is None:
+        parent_scores = fitness.batch(problem, parents)
+    child_scores = fitness.batch(problem, children)
+    size = len(parents)
+    # (is parent, fitness, index) - children first, best first
+    heap = [(0, int(score), i) for i, score in enumerate(child_scores)]
+    order = np.argsort(parent_scores, kind='stable')
+    chosen, scores = [], []
+    present = set()
+    for i in order:
+        key = permutation_key(parents[i])
+        if len(chosen) < elites and key not in present:
+            chosen.append(parents[i])
+            scores.append(parent_scores[i])
+            present.add(key)
+        else:
+            heap.append((1, int(parent_scores[i]), i))
+    heapq.heapify(heap)
+    while heap and len(chosen) < size:
+        is_parent, score, i = heapq.heappop(heap)
+        individual = parents[i] if is_parent else children[i]
+        key = permutation_key(individual)
+        if key in present:
+            continue
+        chosen.append(individual)
+        scores.append(score)
+        present.add(key)
+    population = np.array(chosen, dtype=parents.dtype).reshape(-1, problem.n)
+    scores = np.array(scores, dtype=np.int64)
+    if len(population) < size:
+        fresh = _random_permutations(size - len(population), problem.n)
+        population = np.concatenate([population, fresh.astype(parents.dtype)])
+        scores = np.concatenate([scores, fitness.batch(problem, fresh)])
+    return population, scores
+
+
+class SearchUtilsTests(unittest.TestCase):
+    """Unit Tests for GA operators"""
+
+    def setUp(self):
+        super(SearchUtilsTests, self).setUp()
+        rng = np.random.default_rng(0)
+        n = 8
+        self.problem = Problem.from_arrays(rng.integers(0, 10, size=(n, n)),
+            rng.integers(0, 10, size=(n, n)))
+        self.objective = QapObjective()
+        set_seed(0)
+
+    def test_fitness_cache_evaluates_repeated_permutation_once(self):
+        fitness = FitnessCache(self.objective)
+        P = _random_permutations(3, self.problem.n)
+        batch = P[[0, 1, 0, 2, 1, 0]]
+        self.assertEqual(self.objective.batch(self.problem, batch).tolist(),
+            fitness.batch(self.problem, batch).tolist())
+        self.assertEqual(3, fitness.evaluations)
+        self.assertEqual(3, fitness.hits)
+        fitness.batch(self.problem, P)
+        self.assertEqual(3, fitness.evaluations)
+
+    @staticmethod
+    def _parents(m, n):
+        """Two (m x n) arrays of random parents"""
+        return _random_permutations(m, n), _random_permutations(m, n)
+
+    @staticmethod
+    def _segments(seed, m, n):
+        """Segments drawn by OX and PMX after set_seed(seed)"""
+        set_seed(seed)
+        start, end = _cut_points(m, n)
+        genes = np.arange(n)[None, :]
+        return (genes >= start) & (genes < end), end[:, 0]
+
+    def test_crossover_returns_permutations(self):
+        for n in (1, 2, 3, 17):
+            first, second = SearchUtilsTests._parents(50, n)
+            for name, method in crossover_methods().items():
+                children = method(first, second)
+                self.assertEqual(first.shape, children.shape, name)
+                self.assertTrue((np.sort(children, axis=1) ==
+                    np.arange(n)[None, :]).all(), name)
+
+    def test_order_crossover_keeps_segment_and_order(self):
+        n = 12
+        first, second = SearchUtilsTests._parents(30, n)
+        segment, end = SearchUtilsTests._segments(1, len(first), n)
+        set_seed(1)
+        children = _order_crossover(first, second)
+        self.assertTrue((children[segment] == first[segment]).all())
+        for child, parent, kept, e in zip(children, second, segment, end):
+            # genes out of segment follow second parent from segment end
+            order = [child[(e + k) % n] for k in range(n)
+                if not kept[(e + k) % n]]
+            filled = [parent[(e + k) % n] for k in range(n)
+                if parent[(e + k) % n] in order]
+            self.assertEqual(order, filled)
+
+    def test_partially_mapped_crossover_keeps_segment(self):
+        n = 12
+        first, second = SearchUtilsTests._parents(30, n)
+        segment, _ = SearchUtilsTests._segments(2, len(first), n)
+        set_seed(2)
+        children = _partially_mapped_crossover(first, second)
+        self.assertTrue((children[segment] == first[segment]).all())
+        for child, a, b, kept in zip(children, first, second, segment):
+            # genes of second parent not in segment stay in place
+            free = ~kept & ~np.isin(b, a[kept])
+            self.assertTrue((child[free] == b[free]).all())
+
+    def test_budget_stops_on_limits(self):
+        budget = Budget(max_evaluations=100)
+        budget.charge(60)
+        budget.update(10)
+        self.assertIsNone(budget.stop_reason())
+        budget.charge(40)
+        budget.update(10)
+        self.assertEqual(100, budget.evaluations)
+        self.assertEqual(2, budget.iterations)
+        self.assertEqual('max evaluations', budget.stop_reason())
+        budget = Budget(time_limit=0.2)
+        budget.update(10)
+        self.assertIsNone(budget.stop_reason())
+        time.sleep(0.25)
+        self.assertEqual('time limit', budget.stop_reason())
+        budget = Budget(max_iter=3, stagnation=2, restarts=1)
+        for expected in (False, False, True):
+            budget.update(10)
+            self.assertEqual(expected, budget.should_restart())
+        self.assertEqual('max iterations', budget.stop_reason())
+
+    def test_mutate_rate(self):
+        population = _random_permutations(200, self.problem.n)
+        mutated = mutate(self.problem, population.copy(), rate=0)
+        self.assertTrue((mutated == population).all())
+        mutated = mutate(self.problem, population.copy(), rate=1)
+        # the first two genes of every individual are swapped
+        self.assertTrue((mutated[:, :2] == population[:, 1::-1]).all())
+        self.assertTrue((mutated[:, 2:] == population[:, 2:]).all())
+
+    def test_cycle_crossover_takes_positions_from_parents(self):
+        first, second = SearchUtilsTests._parents(30, 12)
+        children = _cycle_crossover(first, second)
+        self.assertTrue(((children == first) | (children == second)).all())
+        # the first cycle always comes from the first parent
+        self.assertTrue((children[:, 0] == first[:, 0]).all())
+
+    def test_replace_keeps_population_size(self):
+        fitness = FitnessCache(self.objective)
+        parents = np.tile(np.arange(self.problem.n, dtype=np.int32), (10, 1))
+        children = parents[:, ::-1].copy()
+        population, scores = replace(
+            self.problem, fitness, parents, children, elites=2)
+        self.assertEqual(parents.shape, population.shape)
+        self.assertEqual(self.objective.batch(self.problem, population).tolist(),
+            scores.tolist())
+        for p in population:
+            self.assertTrue(satisfies_constraints(self.problem, p))
+        # the only parent and the only child are both kept
+        keys = [permutation_key(p) for p in population]
+        self.assertIn(permutation_key(parents[0]), keys)
+        self.assertIn(permutation_key(children[0]), keys)
+        self.assertEqual(len(keys), len(set(keys)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Simulated annealing solver for quadratic assignment problem
+
+Many independent chains are advanced in lockstep: every step proposes one
+random swap per chain, evaluates all proposals with O(n) swap deltas in a
+single numpy call and accepts them by Metropolis criterion
+"""
+
+import argparse
+import concurrent.futures as futures
+import math
+import time
+import os
+import sys
+import numpy as np
+
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('.'):
+    from lib.problem_utils import Problem
+    from lib.problem_utils import Solution
+    from lib.problem_utils import QapObjective
+    from lib.generate_output import generate_sol
+    from lib.constraints import satisfies_constraints
+
+
+CALIBRATION_SAMPLES = 1000  # random swaps used to calibrate temperature
+TIME_CHECK_STEPS = 100  # steps between wall-clock checks
+
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser("QAP problem parser")
+    parser.add_argument('instances',
+        nargs='+',
+        help='QAP problem instance(s)')
+    parser.add_argument('--no-sol',
+        action='store_true',
+        help='Specifies, whether solution files needs to be generated')
+    parser.add_argument('--time-limit',
+        help='Algorithm time limit (in seconds)',
+        type=int,
+        default=60*60)
+    parser.add_argument('--max-iter',
+        help='Annealing steps per chain',
+        type=int,
+        default=100000)
+    parser.add_argument('--no-cache',
+        action='store_true',
+        help='Do not use on-disk cache of parsed instances')
+    parser.add_argument('--chains',
+        help='Number of independent chains advanced in lockstep (per worker)',
+        type=int,
+        default=32)
+    parser.add_argument('--workers',
+        help='Number of worker processes, each runs own set of chains',
+        type=int,
+        default=1)
+    parser.add_argument('--initial-acceptance',
+        help='Acceptance probability of average uphill move at start',
+        type=float,
+        default=0.5)
+    parser.add_argument('--final-acceptance',
+        help='Acceptance probability of average uphill move at the end',
+        type=float,
+        default=0.001)
+    parser.add_argument('--seed',
+        help='Random seed',
+        type=int,
+        default=11)
+    return parser.parse_args()
+
+
+def _random_swaps(rng, chains, n):
+    """Random pair of distinct facilities per chain"""
+    r = rng.integers(0, n, size=chains)
+    s = (r + rng.integers(1, n, size=chains)) % n
+    return r, s
+
+
+def calibrate(problem, rng, initial_acceptance, final_acceptance):
+    """
+    Initial and final temperatures from deltas of random swaps
+
+    Average uphill delta is accepted with given probabilities at start and
+    at the end of annealing
+    """
+    O = QapObjective()
+    P = np.array([rng.permutation(problem.n)
+        for _ in range(CALIBRATION_SAMPLES)])
+    deltas = O.swap_delta_batch(
+        problem, P, *_random_swaps(rng, CALIBRATION_SAMPLES, problem.n))
+    uphill = deltas[deltas > 0]
+    mean_uphill = float(uphill.mean()) if len(uphill) else 1.0
+    return (-mean_uphill / math.log(initial_acceptance),
+        -mean_uphill / math.log(final_acceptance))
+
+
+def anneal(problem, time_limit, max_iter, chains, seed, initial_acceptance,
+        final_acceptance):
+    """
+    Run lockstep chains with geometric cooling
+
+    Return best permutation, its objective value, number of steps done,
+    seconds spent in annealing and trace of (seconds, best objective) pairs
+    recorded on improvements
+    """
+    rng = np.random.default_rng(seed)
+    O = QapObjective()
+    t_start, t_end = calibrate(
+        problem, rng, initial_acceptance, final_acceptance)
+    cooling = (t_end / t_start) ** (1.0 / max(max_iter - 1, 1))
+    P = np.argsort(rng.random((chains, problem.n)), axis=1)
+    costs = O.batch(problem, P)
+    best_i = int(np.argmin(costs))
+    best_p, best_O = P[best_i].copy(), int(costs[best_i])
+    rows = np.arange(chains)
+    temperature = t_start
+    start = time.time()
+    trace = [(0.0, best_O)]
+    steps = 0
+    for step in range(max_iter):
+        if step % TIME_CHECK_STEPS == 0 and time.time() - start > time_limit:
+            break
+        r, s = _random_swaps(rng, chains, problem.n)
+        deltas = O.swap_delta_batch(problem, P, r, s)
+        # Metropolis criterion, exponent is clipped for downhill moves
+        accept = rng.random(chains) < np.exp(
+            -np.maximum(deltas, 0) / temperature)
+        rows_a, r_a, s_a = rows[accept], r[accept], s[accept]
+        P[rows_a, r_a], P[rows_a, s_a] = P[rows_a, s_a], P[rows_a, r_a]
+        costs[accept] += deltas[accept]
+        i = int(np.argmin(costs))
+        if costs[i] < best_O:
+            best_p, best_O = P[i].copy(), int(costs[i])
+            trace.append((time.time() - start, best_O))
+        temperature *= cooling
+        steps += 1
+    return best_p, best_O, steps, time.time() - start, trace
+
+
+def _merge_traces(traces):
+    """Best objective over time of several concurrently run traces"""
+    merged = []
+    for seconds, objective in sorted(sum(traces, [])):
+        if not merged or objective < merged[-1][1]:
+            merged.append((seconds, objective))
+    return merged
+
+
+def simulated_annealing(problem, time_limit, max_iter, chains=32, workers=1,
+        seed=11, initial_acceptance=0.5, final_acceptance=0.001, stats=None):
+    """
+    SA main entry point
+
+    With workers > 1 every worker process runs own set of chains with own
+    random stream, the best result is taken. If stats dict is given, it is
+    filled with number of evaluated swaps, seconds spent in annealing (by the
+    slowest worker) and trace of (seconds, best objective) pairs recorded on
+    improvements
+    """
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    args = (time_limit, max_iter, chains)
+    tail = (initial_acceptance, final_acceptance)
+    if workers <= 1:
+        results = [anneal(problem, *args, seeds[0], *tail)]
+    else:
+        with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = [executor.submit(anneal, problem, *args, seed, *tail)
+                for seed in seeds]
+            results = [f.result() for f in pending]
+    best_p, best_O, _, _, _ = min(results, key=lambda result: result[1])
+    steps = sum(result[2] for result in results)
+    if stats is not None:
+        stats['evaluations'] = steps * chains
+        stats['seconds'] = max(result[3] for result in results)
+        stats['trace'] = _merge_traces([result[4] for result in results])
+    print('Evaluated moves: {moves} ({steps} steps of {chains} chains in '
+        '{w} worker(s))'.format(moves=steps * chains, steps=steps,
+            chains=chains, w=max(workers, 1)))
+    return Solution(best_p.tolist())
+
+
+def main():
+    """Main entrypoint"""
+    args = parse_args()
+    print(args.instances)
+    for instance in args.instances:
+        name = os.path.splitext(os.path.basename(instance))[0]
+        problem = Problem.from_file(instance, use_cache=not args.no_cache)
+        print('-'*100)
+        print('File: {name}.txt'.format(name=name))
+        stats = {}
+        start = time.time()
+        S = simulated_annealing(problem, args.time_limit, args.max_iter,
+            args.chains, args.workers, args.seed, args.initial_acceptance,
+            args.final_acceptance, stats)
+        elapsed = time.time() - start
+        if S is None:
+            print('! NO SOLUTION FOUND !')
+        else:
+            print('O* = {o}'.format(o=QapObjective()(problem, S)))
+            print('All satisfied?', satisfies_constraints(problem, S))
+            print('----- PERFORMANCE -----')
+            print('SA took {some} seconds ({rate:.0f} moves/s)'.format(
+                some=elapsed, rate=stats['evaluations'] / stats['seconds']
+                    if stats['seconds'] else 0))
+        print('-'*100)
+        if S is not None and not args.no_sol:
+            filedir = os.path.dirname(os.path.abspath(__file__))
+            generate_sol(name, S, cwd=filedir, prefix='_sa_')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
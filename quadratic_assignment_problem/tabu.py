@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Robust tabu search for quadratic assignment problem
+
+Credits: E. Taillard, Robust taboo search for the quadratic assignment problem
+"""
+
+import argparse
+import time
+import os
+import sys
+import numpy as np
+
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('.'):
+    from lib.problem_utils import Problem
+    from lib.problem_utils import Solution
+    from lib.problem_utils import QapObjective
+    from lib.generate_output import generate_sol
+    from lib.constraints import satisfies_constraints
+
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser("QAP problem parser")
+    parser.add_argument('instances',
+        nargs='+',
+        help='QAP problem instance(s)')
+    parser.add_argument('--no-sol',
+        action='store_true',
+        help='Specifies, whether solution files needs to be generated')
+    parser.add_argument('--time-limit',
+        help='Algorithm time limit (in seconds)',
+        type=int,
+        default=60*60)
+    parser.add_argument('--max-iter',
+        help='Algorithm max iterations',
+        type=int,
+        default=100000)
+    parser.add_argument('--no-cache',
+        action='store_true',
+        help='Do not use on-disk cache of parsed instances')
+    parser.add_argument('--seed',
+        help='Random seed',
+        type=int,
+        default=11)
+    return parser.parse_args()
+
+
+def _draw_tenure(rng, n):
+    """Random tabu tenure in [0.9n, 1.1n]"""
+    return int(rng.integers(max(int(0.9 * n), 1), int(1.1 * n) + 2))
+
+
+def tabu_search(problem, time_limit, max_iter, seed=11, stats=None):
+    """
+    Robust tabu search main entry point
+
+    Every iteration applies the best non-tabu swap of two facilities. A swap
+    is tabu if both facilities would return to locations they occupied
+    within the last tenure iterations, unless it improves the best solution
+    (aspiration). Tenure is redrawn at random every 2 * 1.1n iterations.
+    Swap deltas are kept in a matrix updated in O(n^2) per iteration
+
+    If stats dict is given, it is filled with number of evaluated swaps,
+    seconds spent in search and trace of (seconds, best objective) pairs
+    recorded on improvements
+    """
+    # O - objective function
+    # S - current solution
+    # best_S <=> S*
+    rng = np.random.default_rng(seed)
+    O = QapObjective()
+    n = problem.n
+    p = rng.permutation(n)
+    if not satisfies_constraints(problem, Solution(p.tolist())):
+        raise ValueError('initial solution is infeasible')
+    curr_O = O(problem, p)
+    best_p, best_O = p.copy(), curr_O
+    deltas = O.swap_deltas(problem, p)
+    # tabu[i, l]: iteration until facility i may not return to location l
+    tabu = np.zeros((n, n), dtype=np.int64)
+    upper = np.triu(np.ones((n, n), dtype=bool), 1)
+    tenure = _draw_tenure(rng, n)
+    start = time.time()
+    trace = [(0.0, best_O)]
+    iterations = 0
+    for i in range(max_iter):
+        if time.time() - start > time_limit:
+            print('- Timeout reached -')
+            break
+        if i % 10000 == 0:
+            print('So far O* = {o}'.format(o=best_O))
+        if i % (2 * int(1.1 * n + 1)) == 0:
+            tenure = _draw_tenure(rng, n)
+        # forbidden[r, s]: r -> p[s] and s -> p[r] are both tabu
+        returns = tabu[:, p] > i
+        forbidden = returns & returns.T
+        allowed = upper & (~forbidden | (curr_O + deltas < best_O))
+        if not allowed.any():
+            allowed = upper
+        masked = np.where(allowed, deltas, np.iinfo(np.int64).max)
+        r, s = np.unravel_index(np.argmin(masked), masked.shape)
+        tabu[r, p[r]] = i + tenure
+        tabu[s, p[s]] = i + tenure
+        curr_O += deltas[r, s]
+        p[r], p[s] = p[s], p[r]
+        O.update_swap_deltas(problem, p, deltas, r, s)
+        iterations += 1
+        if curr_O < best_O:
+            best_p, best_O = p.copy(), curr_O
+            trace.append((time.time() - start, best_O))
+    if stats is not None:
+        stats['evaluations'] = iterations * n * (n - 1) // 2
+        stats['seconds'] = time.time() - start
+        stats['trace'] = trace
+    return Solution(best_p.tolist())
+
+
+def main():
+    """Main entrypoint"""
+    args = parse_args()
+    print(args.instances)
+    for instance in args.instances:
+        name = os.path.splitext(os.path.basename(instance))[0]
+        problem = Problem.from_file(instance, use_cache=not args.no_cache)
+        print('-'*100)
+        print('File: {name}.txt'.format(name=name))
+        start = time.time()
+        S = tabu_search(problem, args.time_limit, args.max_iter, args.seed)
+        elapsed = time.time() - start
+        if S is None:
+            print('! NO SOLUTION FOUND !')
+        else:
+            print('O* = {o}'.format(o=QapObjective()(problem, S)))
+            print('All satisfied?', satisfies_constraints(problem, S))
+            print('----- PERFORMANCE -----')
+            print('Tabu search took {some} seconds'.format(some=elapsed))
+        print('-'*100)
+        if S is not None and not args.no_sol:
+            filedir = os.path.dirname(os.path.abspath(__file__))
+            generate_sol(name, S, cwd=filedir, prefix='_tabu_')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+"""
+Decomposition solver for large VRP instances
+
+Routes of the current solution are partitioned into groups of neighbouring
+routes, each group (with the depot) forms a sub-problem that is optimized
+independently by ILS or GLS in a worker process. Improved groups are merged
+back and the procedure repeats with shifted partitions.
+"""
+
+import os
+import sys
+import time
+import math
+import multiprocessing
+import concurrent.futures as futures
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('.'):
+    from lib.parser import basic_parser
+    from lib.graph import Graph
+    from lib.graph import Solution
+    import lib.search_utils as search
+    from lib.constraints import satisfies_all_constraints
+    from lib.generate_output import generate_sol
+    from iterated_local_search import IlsObjective
+    from iterated_local_search import iterated_local_search
+    from guided_local_search import guided_local_search
+
+
+VERBOSE = False  # enabled when run as a script
+
+
+# partitioning
+def _barycentre(route):
+    """Average coordinates of customers in route (depots excluded)"""
+    customers = [c for c in route if not c.is_depot]
+    if not customers:
+        return 0.0, 0.0
+    return (sum(c.x for c in customers) / len(customers),
+        sum(c.y for c in customers) / len(customers))
+
+
+def _partition_by_angle(graph, solution, group_size, shift):
+    """Sweep routes by polar angle of barycentre around depot"""
+    depot = graph.depot
+    def angle(ri):
+        x, y = _barycentre(solution[ri])
+        return math.atan2(y - depot.y, x - depot.x)
+    order = sorted(range(len(solution)), key=angle)
+    if order:
+        shift %= len(order)
+        order = order[shift:] + order[:shift]
+    return [order[i:i+group_size] for i in range(0, len(order), group_size)]
+
+
+def _partition_by_barycentre(graph, solution, group_size, shift):
+    """Greedily group each seed route with routes of closest barycentres"""
+    centres = [_barycentre(route) for route in solution]
+    left = list(range(len(solution)))
+    if left:
+        shift %= len(left)
+        left = left[shift:] + left[:shift]
+    groups = []
+    while left:
+        seed = left.pop(0)
+        sx, sy = centres[seed]
+        left.sort(key=lambda ri: (centres[ri][0] - sx)**2 + (centres[ri][1] - sy)**2)
+        groups.append([seed] + left[:group_size-1])
+        left = left[group_size-1:]
+    return groups
+
+
+def partition_methods():
+    """Return available route partitioning methods"""
+    return {
+        'angle': _partition_by_angle,
+        'barycentre': _partition_by_barycentre
+    }
+
+
+# sub-problems
+def _make_subproblem(graph, solution, group):
+    """Return picklable sub-problem data for group of route indices"""
+    customers = []
+    for ri in group:
+        customers += [c for c in solution[ri] if not c.is_depot]
+    sub_ids = {c.id: sub_id for sub_id, c in enumerate(customers, start=1)}
+    sub_ids[graph.depot.id] = 0
+    routes = [[sub_ids[c.id] for c in solution[ri]] for ri in group]
+    data = [[sub_id] + c.values[1:]
+        for sub_id, c in enumerate([graph.depot] + customers)]
+    return {
+        'name': graph.name,
+        'capacity': graph.capacity,
+        'vehicle_number': len(group),
+        'data': data,
+        'routes': routes,
+    }
+
+
+def _solve_subproblem(subproblem, solver, max_iter, time_limit, excludes,
+        penalty_factor, two_opt, ls_mode, seed):
+    """Optimize sub-problem (worker process entry point)"""
+    graph = Graph.from_data(subproblem['name'], subproblem['vehicle_number'],
+        subproblem['capacity'], subproblem['data'])
+    by_id = sorted(graph.customers, key=lambda c: c.id)
+    initial = Solution([[by_id[i] for i in route]
+        for route in subproblem['routes']])
+    if solver == 'gls':
+        S = guided_local_search(graph, penalty_factor, max_iter, time_limit,
+            excludes, two_opt, initial=initial, ls_mode=ls_mode, seed=seed)
+    else:
+        S = iterated_local_search(graph, max_iter, time_limit, excludes,
+            two_opt, initial=initial, ls_mode=ls_mode, seed=seed)
+    if S is None or not satisfies_all_constraints(graph, S):
+        return None
+    return [[c.id for c in route] for route in S if len(route) > 2]
+
+
+def _merge(graph, solution, groups, results):
+    """Replace groups of routes with improved sub-problem solutions"""
+    O = IlsObjective()
+    routes = []
+    improved = 0
+    for group, sub_routes in zip(groups, results):
+        old_routes = [solution[ri] for ri in group]
+        if sub_routes is not None:
+            # map sub-graph ids back to original customers
+            originals = [graph.depot]
+            for ri in group:
+                originals += [c for c in solution[ri] if not c.is_depot]
+            new_routes = [[originals[i] for i in route] for route in sub_routes]
+            old_O = O(graph, Solution(old_routes), None)
+            if O(graph, Solution(new_routes), None) < old_O - 1e-9:
+                old_routes = new_routes
+                improved += 1
+        routes += old_routes
+    return Solution(routes), improved
+
+
+def decomposition_search(graph, solver, rounds, group_size, partition,
+        max_iter, time_limit, sub_time_limit, excludes, penalty_factor=0.2,
+        two_opt='first', workers=None, ls_mode='all', seed=11):
+    """
+    Decomposition search algorithm
+
+    Note: sub-problem solvers are seeded from seed, round and group index
+    """
+    O = IlsObjective()
+    S = search.construct_initial_solution(graph, O)
+    if not satisfies_all_constraints(graph, S):
+        return None
+    if VERBOSE:
+        print('O = {o}'.format(o=O(graph, S, None)))
+    partition = partition_methods()[partition]
+    workers = workers or multiprocessing.cpu_count()
+    start = time.time()
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for i in range(rounds):
+            remaining = time_limit - (time.time() - start)
+            if remaining <= 0:
+                print('- Timeout reached -')
+                break
+            # shift partition by half a group each round so that routes on
+            # the group borders are optimized together next time
+            groups = partition(graph, S, group_size, i * max(group_size // 2, 1))
+            subproblems = [_make_subproblem(graph, S, g) for g in groups]
+            pending = [executor.submit(_solve_subproblem, sp, solver, max_iter,
+                min(sub_time_limit, remaining), excludes, penalty_factor,
+                two_opt, ls_mode, '{s}:{i}:{g}'.format(s=seed, i=i, g=g))
+                for g, sp in enumerate(subproblems)]
+            results = [f.result() for f in pending]
+            S, improved = _merge(graph, S, groups, results)
+            if VERBOSE:
+                print('Round {i}: O = {o}, improved groups: {n}/{total}'.format(
+                    i=i, o=O(graph, S, None), n=improved, total=len(groups)))
+    return S
+
+
+def main():
+    """Main entry point"""
+    parser = basic_parser()
+    # decomposition extensions to parser
+    parser.add_argument('--solver',
+        help='Algorithm used for sub-problems',
+        choices=['ils', 'gls'],
+        default='ils')
+    parser.add_argument('--rounds',
+        help='Number of partition-optimize-merge rounds',
+        type=int,
+        default=10)
+    parser.add_argument('--group-size',
+        help='Number of routes per sub-problem',
+        type=int,
+        default=4)
+    parser.add_argument('--partition',
+        help='Route partitioning method',
+        choices=partition_methods().keys(),
+        default='angle')
+    parser.add_argument('--sub-time-limit',
+        help='Time limit per sub-problem (in seconds)',
+        type=int,
+        default=60)
+    parser.add_argument('--workers',
+        help='Number of worker processes (default: number of CPUs)',
+        type=int,
+        default=None)
+    parser.add_argument('--penalty-factor',
+        help='GLS penalty factor for sub-problems',
+        type=float,
+        default=0.2)
+    args = parser.parse_args()
+    if VERBOSE:
+        print(args.instances)
+    for instance in args.instances:
+        graph = Graph.from_file(instance, args.memory_light, args.neighbours,
+            use_cache=not args.no_cache)
+        graph.name = os.path.splitext(os.path.basename(instance))[0]
+        if VERBOSE:
+            print('-'*100)
+            print('File: {name}.txt'.format(name=graph.name))
+        start = time.time()
+        S = decomposition_search(graph, args.solver, args.rounds,
+            args.group_size, args.partition, args.max_iter, args.time_limit,
+            args.sub_time_limit, args.exclude_ls, args.penalty_factor,
+            args.two_opt, args.workers, args.ls_mode, args.seed)
+        elapsed = time.time() - start
+        if VERBOSE:
+            if S is None:
+                print('! NO SOLUTION FOUND: NO SATISFYING INITIAL !')
+            else:
+                print('O* = {o}'.format(o=IlsObjective()(graph, S, None)))
+                print('All served?', S.all_served(graph.customer_number))
+                print('Everything satisfied?', satisfies_all_constraints(graph, S))
+                print('----- PERFORMANCE -----')
+                print('Decomposition took {some} seconds'.format(some=elapsed))
+            print('-'*100)
+        if S is not None and not args.no_sol:
+            filedir = os.path.dirname(os.path.abspath(__file__))
+            generate_sol(graph, S, cwd=filedir, prefix='_decomposition_')
+    return 0
+
+
+if __name__ == '__main__':
+    VERBOSE = True
+    sys.exit(main())
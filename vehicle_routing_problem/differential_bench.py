@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""
+Differential test and benchmark of fast evaluation paths
+
+Random moves are evaluated on test instances both by fast paths and by
+reference functions. Mismatches and speedup per check are reported, exit code
+is non-zero if any mismatch is found
+"""
+
+import argparse
+import glob
+import os
+import sys
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('.'):
+    from lib.graph import Graph
+    import lib.search_utils as search
+    from lib.constraints import satisfies_all_constraints
+    from lib.differential import differential_check
+    from lib.local_search_strategies import DistanceObjective
+
+
+def _solutions(graph):
+    """Initial solution and its local optimum (if initial is feasible)"""
+    O = DistanceObjective()
+    S = search.construct_initial_solution(graph, O)
+    solutions = [('initial', S)]
+    if satisfies_all_constraints(graph, S):
+        solutions.append(('local optimum', search.local_search(
+            graph, O, S, {'ls_mode': 'vnd'})))
+    return solutions
+
+
+def main():
+    """Main entry point"""
+    filedir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser("")
+    parser.add_argument('instances',
+        nargs='*',
+        help='Vehicle Routing Problem instance file(s) (default: test_data)',
+        default=sorted(glob.glob(os.path.join(filedir, 'test_data', '*.txt'))))
+    parser.add_argument('--samples',
+        help='Number of random moves per check',
+        type=int,
+        default=2000)
+    parser.add_argument('--seed',
+        help='Random seed',
+        type=int,
+        default=0)
+    args = parser.parse_args()
+    row = '{:<14} {:<14} {:<12} {:>8} {:>10} {:>12} {:>12} {:>9}'
+    print(row.format('instance', 'solution', 'check', 'cases', 'mismatches',
+        'reference,s', 'fast,s', 'speedup'))
+    total_mismatches = 0
+    for instance in args.instances:
+        graph = Graph.from_file(instance)
+        name = os.path.splitext(os.path.basename(instance))[0]
+        for label, S in _solutions(graph):
+            for report in differential_check(graph, S, args.samples, args.seed):
+                total_mismatches += report['mismatches']
+                print(row.format(name, label, report['check'],
+                    report['cases'], report['mismatches'],
+                    '{:.4f}'.format(report['reference_time']),
+                    '{:.4f}'.format(report['fast_time']),
+                    '{:.1f}x'.format(report['speedup'])))
+    print('Total mismatches: {n}'.format(n=total_mismatches))
+    return 1 if total_mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
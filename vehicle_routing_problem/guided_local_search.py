@@ -6,6 +6,7 @@ import sys
 import time
 import progressbar
 import math
+import random
 import time
 
 # local imports
@@ -25,21 +26,33 @@ with import_from('.'):
     from lib.graph import Graph
     from lib.graph import Objective
     from lib.graph import PenaltyMap
+    from lib.graph import SparsePenaltyMap
     import lib.search_utils as search
     from lib.visualize import visualize
     from lib.constraints import satisfies_all_constraints
     from lib.generate_output import generate_sol
+    import lib.local_search_strategies as lss
+
+
+VERBOSE = False  # enabled when run as a script
 
 
 class GlsObjective(Objective):
-    """Guided local search objective function"""
+    """
+    Guided local search objective function
+
+    Penalized features md['f'] are fixed during local search, so the penalty
+    term is constant and move deltas are distance deltas
+    """
+    supports_batches = True
+
     def __call__(self, graph, solution, md):
         """operator() overload"""
         value = self._distance(graph, solution)
         if md:
             if md.get('ri', None) is not None:
                 return self._route_distance(graph, solution[md['ri']])
-            if md['f']:
+            if md.get('f'):
                 value += md['lambda'] * sum(
                     [md['p'][(a, b)] * graph.costs[(a, b)] for a, b in md['f']])
         return value
@@ -63,22 +76,37 @@ def _most_utilized_feature(graph, md):
         reverse=True)[0][0]
 
 
-def guided_local_search(graph, penalty_factor, max_iter, time_limit, excludes):
+def guided_local_search(graph, penalty_factor, max_iter, time_limit, excludes,
+        two_opt='first', initial=None, ls_mode='all', ls_stats=None,
+        pair_workers=0, seed=11):
     """Guided local search algorithm"""
     # O - objective function
     # S - current solution
     # best_S <=> S*
     # MD - method specific supplementary data
     best_S = None
+    pair_pool = None
+    if pair_workers:
+        pair_pool = lss.route_pair_pool(graph, pair_workers)
     try:
         O = GlsObjective()
+        penalties = PenaltyMap(graph.raw_data)
+        if graph.memory_light:
+            penalties = SparsePenaltyMap()
         MD = {
-            'p': PenaltyMap(graph.raw_data),  # penalties
+            'p': penalties,  # penalties
             'lambda': penalty_factor,
             'f': [],  # feature set,
-            'ignore_feasibility': False
+            'ignore_feasibility': False,
+            'two_opt': two_opt,  # 2-opt improvement strategy
+            'ls_mode': ls_mode,  # how LS heuristics are combined
+            'ls_stats': ls_stats,  # LS heuristics credits
+            'pair_pool': pair_pool,  # route pair search workers
+            'random': random.Random(seed)  # LS random generator
         }
-        S = search.construct_initial_solution(graph, O, MD)
+        S = initial
+        if S is None:
+            S = search.construct_initial_solution(graph, O, MD)
         if not satisfies_all_constraints(graph, S):
             raise ValueError("couldn't find satisfying initial solution")
         best_S = S
@@ -112,10 +140,13 @@ def guided_local_search(graph, penalty_factor, max_iter, time_limit, excludes):
     except TimeoutError:
         pass  # supress timeout errors, expecting only from algo timeout
     finally:
-        if best_S is None:
-            return None
-        # final LS with no penalties to get true local min
-        return search.local_search(graph, O, best_S, None, excludes)
+        if best_S is not None:
+            # final LS with no penalties to get true local min
+            best_S = search.local_search(
+                graph, O, best_S, search.ls_settings(MD), excludes)
+        if pair_pool is not None:
+            pair_pool.terminate()
+        return best_S
 
 
 def main():
@@ -129,16 +160,18 @@ def main():
     if VERBOSE:
         print(args.instances)
     for instance in args.instances:
-        graph = None
-        with open(instance, 'r') as instance_file:
-            graph = Graph(instance_file)
-            graph.name = os.path.splitext(os.path.basename(instance))[0]
+        graph = Graph.from_file(instance, args.memory_light, args.neighbours,
+            use_cache=not args.no_cache)
+        graph.name = os.path.splitext(os.path.basename(instance))[0]
         if VERBOSE:
             print('-'*100)
             print('File: {name}.txt'.format(name=graph.name))
+        stats = search.OperatorStats()
         start = time.time()
         S = guided_local_search(
-            graph, args.penalty_factor, args.max_iter, args.time_limit, args.exclude_ls)
+            graph, args.penalty_factor, args.max_iter, args.time_limit,
+            args.exclude_ls, args.two_opt, ls_mode=args.ls_mode,
+            ls_stats=stats, pair_workers=args.pair_workers, seed=args.seed)
         elapsed = time.time() - start
         if VERBOSE:
             if S is None:
@@ -149,6 +182,9 @@ def main():
                 print('Everything satisfied?', satisfies_all_constraints(graph, S))
                 print('----- PERFORMANCE -----')
                 print('GLS took {some} seconds'.format(some=elapsed))
+                print('----- LS HEURISTICS -----')
+                for line in stats.summary():
+                    print(line)
                 # visualize(S)
             print('-'*100)
         if S is not None and not args.no_sol:
@@ -6,6 +6,7 @@ import sys
 import time
 import progressbar
 import math
+import random
 import copy
 import time
 
@@ -30,11 +31,19 @@ with import_from('.'):
     from lib.visualize import visualize
     from lib.constraints import satisfies_all_constraints
     from lib.generate_output import generate_sol
-    from lib.local_search_strategies import swap_nodes
+    import lib.local_search_strategies as lss
+    from lib.perturbation import PerturbationPool
+
+
+VERBOSE = False  # enabled when run as a script
+VISITED_CACHE_SIZE = 256  # max number of remembered local optima
+HISTORY_SIZE = 4096  # max number of remembered perturbation moves
 
 
 class IlsObjective(Objective):
     """Iterated local search objective function"""
+    supports_batches = True  # objective is distance
+
     def __call__(self, graph, solution, md):
         """operator() overload"""
         if md and md.get('ri', None) is not None:
@@ -42,82 +51,36 @@ class IlsObjective(Objective):
         return self._distance(graph, solution)
 
 
-def _sort_solution_by_objective(graph, O, S):
-    """Sort routes by impact on objective function in descending order"""
-    return sorted([ri for ri in range(len(S))],
-        key=lambda x: O(graph, S, {'ri': x}), reverse=True)
-
-
-def _make_history_tuple(i, j, r, k):
-    return tuple(sorted([i, j, r, k]))
-
-
-def _perturbation(graph, O, S, md):
-    """Perform perturbation between routes on solution"""
-    # sort by highest objective
-    # as O -> min, maximal values are bad
-    # we need to try to reduce max values / compensate
-    # this way LS can be guided towards a better solution
-    routes = _sort_solution_by_objective(graph, O, S)
-    four_opt_performed = False
-    while not four_opt_performed and routes:
-        ri_a = routes.pop(0)
-        route_a = S[ri_a]
-        for i in range(len(routes)):
-            if four_opt_performed:
-                break
-            ri_b = routes[i]
-            route_b = S[ri_b]
-            for ci_a in range(len(route_a) - 1):
-                if four_opt_performed:
-                    break
-                # skip depots
-                if route_a[ci_a] == graph.depot:
-                    continue
-                if route_a[ci_a + 1] == graph.depot:
-                    break
-                for ci_b in range(len(route_b) - 1):
-                    # skip depots
-                    if route_b[ci_b] == graph.depot:
-                        continue
-                    if route_b[ci_b + 1] == graph.depot:
-                        break
-                    if _make_history_tuple(ci_a, ci_a + 1, ci_b, ci_b + 1) in md['history']:
-                        # skip already swapped customers
-                        continue
-                    # reverse swap two customers from each route
-                    new_route_a, new_route_b = swap_nodes(
-                        route_a, route_b, ci_a, ci_b + 1)
-                    new_route_a, new_route_b = swap_nodes(
-                        new_route_a, new_route_b, ci_a + 1, ci_b)
-                    new_S = S.changed(new_route_a, ri_a)
-                    new_S = new_S.changed(new_route_b, ri_b)
-                    satisfies = satisfies_all_constraints(graph, new_S)
-                    if not satisfies:
-                        continue
-                    S = new_S
-                    four_opt_performed = True
-                    # add current tuple of 4 customers to history
-                    md['history'].add(
-                        _make_history_tuple(ci_a, ci_a + 1, ci_b, ci_b + 1))
-                    break
-    return S
-
-
-def iterated_local_search(graph, max_iter, time_limit, excludes):
+def iterated_local_search(graph, max_iter, time_limit, excludes,
+        two_opt='first', initial=None, ls_mode='all', ls_stats=None,
+        pair_workers=0, seed=11):
     """Iterated local search algorithm"""
     # O - objective function
     # S - current solution
     # best_S <=> S*
     # MD - method specific supplementary data
     best_S = None
+    pair_pool = None
+    if pair_workers:
+        pair_pool = lss.route_pair_pool(graph, pair_workers)
     try:
         O = IlsObjective()
         MD = {
             'ignore_feasibility': False,
-            'history': set(),  # history of perturbation: swapped customers
+            'two_opt': two_opt,  # 2-opt improvement strategy
+            'ls_mode': ls_mode,  # how LS heuristics are combined
+            'ls_stats': ls_stats,  # LS heuristics credits
+            'pair_pool': pair_pool,  # route pair search workers
+            'random': random.Random(seed),  # LS random generator
+            # perturbation moves pool with history of applied moves
+            'perturbation': PerturbationPool(graph, history_size=HISTORY_SIZE,
+                seed=seed),
+            # perturbed solution fingerprint -> local optimum found from it
+            'visited': search.LruCache(maxsize=VISITED_CACHE_SIZE),
         }
-        S = search.construct_initial_solution(graph, O, MD)
+        S = initial
+        if S is None:
+            S = search.construct_initial_solution(graph, O, MD)
         if not satisfies_all_constraints(graph, S):
             raise ValueError("couldn't find satisfying initial solution")
         best_S = S
@@ -136,8 +99,14 @@ def iterated_local_search(graph, max_iter, time_limit, excludes):
                 raise TimeoutError('algorithm timeout reached')
 
             # main logic
-            S = _perturbation(graph, O, S, MD)
-            S = search.local_search(graph, O, S, None, excludes)
+            S = MD['perturbation'].perturb(O, S)
+            perturbed = S.fingerprint
+            if perturbed in MD['visited']:
+                # local search was already run from this state
+                S = MD['visited'].get(perturbed)
+            else:
+                S = search.local_search(graph, O, S, MD, excludes)
+                MD['visited'][perturbed] = S
 
             if VERBOSE and i % max_iter / 10 == 0:
                 print("O* so far:", O(graph, best_S, None))
@@ -157,10 +126,13 @@ def iterated_local_search(graph, max_iter, time_limit, excludes):
     except TimeoutError:
         pass  # supress timeout errors, expecting only from algo timeout
     finally:
-        if best_S is None:
-            return None
-        # final LS just in case
-        return search.local_search(graph, O, best_S, None, excludes)
+        if best_S is not None:
+            # final LS just in case
+            best_S = search.local_search(
+                graph, O, best_S, search.ls_settings(MD), excludes)
+        if pair_pool is not None:
+            pair_pool.terminate()
+        return best_S
 
 
 def main():
@@ -169,15 +141,17 @@ def main():
     if VERBOSE:
         print(args.instances)
     for instance in args.instances:
-        graph = None
-        with open(instance, 'r') as instance_file:
-            graph = Graph(instance_file)
-            graph.name = os.path.splitext(os.path.basename(instance))[0]
+        graph = Graph.from_file(instance, args.memory_light, args.neighbours,
+            use_cache=not args.no_cache)
+        graph.name = os.path.splitext(os.path.basename(instance))[0]
         if VERBOSE:
             print('-'*100)
             print('File: {name}.txt'.format(name=graph.name))
+        stats = search.OperatorStats()
         start = time.time()
-        S = iterated_local_search(graph, args.max_iter, args.time_limit, args.exclude_ls)
+        S = iterated_local_search(graph, args.max_iter, args.time_limit,
+            args.exclude_ls, args.two_opt, ls_mode=args.ls_mode,
+            ls_stats=stats, pair_workers=args.pair_workers, seed=args.seed)
         elapsed = time.time() - start
         if VERBOSE:
             if S is None:
@@ -188,6 +162,9 @@ def main():
                 print('Everything satisfied?', satisfies_all_constraints(graph, S))
                 print('----- PERFORMANCE -----')
                 print('ILS took {some} seconds'.format(some=elapsed))
+                print('----- LS HEURISTICS -----')
+                for line in stats.summary():
+                    print(line)
                 # visualize(S)
             print('-'*100)
         if S is not None and not args.no_sol:
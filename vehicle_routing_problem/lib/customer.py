@@ -83,14 +83,23 @@ class Customer(object):
 
 class Matrix(object):
     """Abstract matrix to store customer info in cells"""
-    def __init__(self, rows, operation):
-        """Init method"""
+    def __init__(self, rows, operation, values=None):
+        """
+        Init method
+
+        :param values:
+            Precomputed cells per row, operation is not called if given
+        """
         self.elements = {}
-        for row in rows:
-            self.elements[Customer(row)] = [None] * len(rows)
-        for e in self.elements.keys():
-            for i, other in enumerate(self.elements.keys()):
-                self.elements[e][i] = operation(e, other)
+        if values is not None:
+            for row, row_values in zip(rows, values):
+                self.elements[Customer(row)] = row_values
+        else:
+            for row in rows:
+                self.elements[Customer(row)] = [None] * len(rows)
+            for e in self.elements.keys():
+                for i, other in enumerate(self.elements.keys()):
+                    self.elements[e][i] = operation(e, other)
         self._depot_customer = None
         for c in self.elements.keys():
             if c.is_depot:
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+"""
+Differential checks of fast evaluation paths against reference functions
+
+Fast paths (batched move evaluation, vectorized 2-opt deltas, arc pruning
+masks, incremental fingerprints) are compared with straightforward reference
+computations (Objective._distance, satisfies_all_constraints, full hash
+recomputation) on random moves. Every check reports number of mismatches and
+time spent by both sides
+"""
+
+import os
+import random
+import time
+import unittest
+import numpy as np
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('../'):
+    from lib.graph import Graph
+    from lib.graph import Solution
+    from lib.graph import route_hash
+    from lib.graph import MOVE_RELOCATE
+    from lib.graph import MOVE_EXCHANGE
+    from lib.search_utils import construct_initial_solution
+    from lib.constraints import satisfies_all_constraints
+    from lib.local_search_strategies import DistanceObjective
+    from lib.local_search_strategies import relocate_move
+    from lib.local_search_strategies import exchange_move
+    from lib.local_search_strategies import two_opt_swap
+    from lib.local_search_strategies import two_opt_deltas
+
+
+EPS = 1e-6  # tolerance of objective deltas
+
+
+def _report(name, cases, mismatches, reference_time, fast_time):
+    """Make report entry of single check"""
+    return {
+        'check': name,
+        'cases': cases,
+        'mismatches': mismatches,
+        'reference_time': reference_time,
+        'fast_time': fast_time,
+        'speedup': reference_time / fast_time if fast_time > 0 else float('inf'),
+    }
+
+
+def random_moves(solution, kind, count, rng):
+    """Generate encoded moves of given kind between random distinct routes"""
+    routes = [ri for ri in range(len(solution)) if len(solution[ri]) > 2]
+    moves = []
+    if len(routes) < 2:
+        return moves
+    for _ in range(count):
+        ra, rb = rng.sample(routes, 2)
+        pa = rng.randrange(1, len(solution[ra]) - 1)
+        if kind == MOVE_RELOCATE:
+            if rng.random() < 0.1:
+                # new route
+                moves.append((kind, ra, pa, len(solution), 1))
+                continue
+            pb = rng.randrange(1, len(solution[rb]))
+        else:
+            pb = rng.randrange(1, len(solution[rb]) - 1)
+        moves.append((kind, ra, pa, rb, pb))
+    return moves
+
+
+def _reference_move(graph, objective, solution, move):
+    """Delta and feasibility of move by applying it"""
+    apply = relocate_move if move[0] == MOVE_RELOCATE else exchange_move
+    new_S, changed = apply(solution, *move[1:])
+    delta = objective._distance(graph, new_S) - \
+        objective._distance(graph, solution)
+    # constraints of the changed routes and vehicle number
+    feasible = all(satisfies_all_constraints(graph, new_S, ri)
+        for ri in changed)
+    feasible &= satisfies_all_constraints(graph, new_S,
+        excludes=['time', 'capacity', 'service'])
+    return delta, feasible
+
+
+def check_moves(graph, solution, kind, count, rng):
+    """Compare Objective.evaluate_moves against applied moves"""
+    objective = DistanceObjective()
+    moves = random_moves(solution, kind, count, rng)
+    if not moves:
+        return 0, 0, 0.0, 0.0
+    start = time.perf_counter()
+    reference = [_reference_move(graph, objective, solution, move)
+        for move in moves]
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    deltas, feasible = objective.evaluate_moves(graph, solution, moves)
+    fast_time = time.perf_counter() - start
+    mismatches = 0
+    for (ref_delta, ref_feasible), delta, ok in zip(reference, deltas, feasible):
+        if ref_feasible != ok or abs(ref_delta - delta) > EPS:
+            mismatches += 1
+    return len(moves), mismatches, reference_time, fast_time
+
+
+def check_two_opt(graph, solution):
+    """
+    Compare vectorized 2-opt deltas against reversed routes
+
+    The mask is a necessary condition: every feasible reversal must pass it
+    """
+    objective = DistanceObjective()
+    cases, mismatches = 0, 0
+    reference_time, fast_time = 0.0, 0.0
+    for ri in range(len(solution)):
+        route = solution[ri]
+        if len(route) < 4:
+            continue
+        start = time.perf_counter()
+        deltas, mask = two_opt_deltas(graph, np.array([c.id for c in route]))
+        fast_time += time.perf_counter() - start
+        start = time.perf_counter()
+        base = objective._route_distance(graph, route)
+        for i in range(1, len(route) - 2):
+            for k in range(i + 1, len(route) - 1):
+                new_S = solution.changed(two_opt_swap(route, i, k), ri)
+                delta = objective._route_distance(graph, new_S[ri]) - base
+                feasible = satisfies_all_constraints(graph, new_S, ri)
+                cases += 1
+                if abs(delta - deltas[i-1, k-1]) > EPS or \
+                        (feasible and not mask[i-1, k-1]):
+                    mismatches += 1
+        reference_time += time.perf_counter() - start
+    return cases, mismatches, reference_time, fast_time
+
+
+def check_arc_masks(graph, count, rng):
+    """
+    Compare pruning masks against single pair routes
+
+    Masks are necessary conditions: a pair rejected by them must make route
+    depot -> a -> b -> depot infeasible
+    """
+    customers = [c for c in graph.customers if not c.is_depot]
+    pairs = [tuple(rng.sample(customers, 2)) for _ in range(count)]
+    start = time.perf_counter()
+    reference = [satisfies_all_constraints(graph,
+        Solution([[graph.depot, a, b, graph.depot]]), 0) for a, b in pairs]
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    a_ids = np.array([a.id for a, _ in pairs])
+    b_ids = np.array([b.id for _, b in pairs])
+    arc_ok = graph.gather_arc_feasible(a_ids, b_ids)
+    fits = [graph.fits_together(a, b) for a, b in pairs]
+    fast_time = time.perf_counter() - start
+    mismatches = sum(1 for ok, arc, fit in zip(reference, arc_ok, fits)
+        if ok and not (arc and fit))
+    # scalar and vectorized masks must agree
+    mismatches += sum(1 for (a, b), arc in zip(pairs, arc_ok)
+        if graph.arc_feasible(a, b) != arc)
+    return len(pairs), mismatches, reference_time, fast_time
+
+
+def check_fingerprints(graph, solution, count, rng):
+    """Compare incrementally updated fingerprints against recomputed ones"""
+    moves = random_moves(solution, MOVE_EXCHANGE, count, rng)
+    solutions = []
+    start = time.perf_counter()
+    for move in moves:
+        solutions.append(exchange_move(solution, *move[1:]))
+    fast_time = time.perf_counter() - start
+    start = time.perf_counter()
+    recomputed = [Solution(list(new_S.routes)) for new_S, _ in solutions]
+    reference_time = time.perf_counter() - start
+    mismatches = 0
+    for (new_S, changed), ref_S in zip(solutions, recomputed):
+        if new_S.fingerprint != ref_S.fingerprint:
+            mismatches += 1
+        elif any(new_S.route_fingerprint(ri) != route_hash(new_S[ri])
+                for ri in changed):
+            mismatches += 1
+    return len(moves), mismatches, reference_time, fast_time
+
+
+def differential_check(graph, solution=None, samples=1000, seed=0):
+    """
+    Run all differential checks on solution (initial one by default)
+
+    Return list of reports: check name, number of cases and mismatches, time
+    of reference and fast paths and speedup
+    """
+    rng = random.Random(seed)
+    if solution is None:
+        solution = construct_initial_solution(graph, DistanceObjective())
+    checks = [
+        ('relocate', lambda: check_moves(
+            graph, solution, MOVE_RELOCATE, samples, rng)),
+        ('exchange', lambda: check_moves(
+            graph, solution, MOVE_EXCHANGE, samples, rng)),
+        ('2-opt', lambda: check_two_opt(graph, solution)),
+        ('arc masks', lambda: check_arc_masks(graph, samples, rng)),
+        ('fingerprint', lambda: check_fingerprints(
+            graph, solution, samples, rng)),
+    ]
+    return [_report(name, *check()) for name, check in checks]
+
+
+class DifferentialTests(unittest.TestCase):
+    """Unit Tests for fast evaluation paths"""
+    INSTANCES = ['c108.txt', 'r202.txt']
+
+    def test_fast_paths_match_reference(self):
+        data_dir = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), '..', 'test_data')
+        for name in DifferentialTests.INSTANCES:
+            with open(os.path.join(data_dir, name), 'r') as instance_file:
+                graph = Graph(instance_file)
+            for report in differential_check(graph, samples=200):
+                self.assertEqual(0, report['mismatches'],
+                    '{name}: {check}'.format(name=name, check=report['check']))
+                self.assertTrue(report['cases'])
+
+
+if __name__ == '__main__':
+    unittest.main()
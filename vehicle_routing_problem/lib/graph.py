@@ -2,6 +2,9 @@
 
 from abc import ABC, abstractmethod
 import math
+import threading
+from collections import OrderedDict
+import numpy as np
 
 # local imports
 from contextlib import contextmanager
@@ -16,22 +19,93 @@ def import_from(rel_path):
     sys.path.pop(0)
 
 with import_from('../'):
+    from lib.customer import Customer
     from lib.customer import Matrix
 
+with import_from('../../common'):
+    import instance_cache
+
+
+NEIGHBOURS_K = 50  # neighbours stored per customer in memory-light mode
+_MASK_64 = (1 << 64) - 1
+_EDGE_KEYS = {}  # memoized Zobrist keys per directed edge
+SCHEDULE_CACHE_SIZE = 4096  # route schedules remembered by objective
+
+# encoded moves: rows of (type, route a, position a, route b, position b)
+MOVE_RELOCATE = 0  # move a[pos a] into route b right before b[pos b]
+MOVE_EXCHANGE = 1  # swap a[pos a] and b[pos b]
+
+
+def _splitmix64(value):
+    """Mix 64-bit integer value (splitmix64 finalizer)"""
+    value = (value + 0x9E3779B97F4A7C15) & _MASK_64
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK_64
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK_64
+    return value ^ (value >> 31)
+
+
+def edge_key(a, b):
+    """
+    Zobrist key of directed edge a -> b
+
+    Keys are derived from customer ids (not drawn from a random table), so
+    they are identical in every process and for every graph
+    """
+    packed = (a.id << 32) | b.id
+    key = _EDGE_KEYS.get(packed)
+    if key is None:
+        key = _splitmix64(packed)
+        _EDGE_KEYS[packed] = key
+    return key
+
+
+def route_hash(route):
+    """Zobrist hash of route: XOR of its edge keys"""
+    value = 0
+    for i in range(len(route)-1):
+        value ^= edge_key(route[i], route[i+1])
+    return value
+
 
 class Solution(object):
     """
     VRP solution representation
+
+    Solution keeps a 64-bit edge-based Zobrist hash (fingerprint) which is
+    updated per changed route. Two solutions are equal when they consist of
+    the same directed edges, regardless of the order of routes
     """
-    def __init__(self, routes):
+    def __init__(self, routes, route_hashes=None):
         """Init method"""
         self._routes = routes
+        if route_hashes is None:
+            route_hashes = [route_hash(route) for route in routes]
+        self._route_hashes = route_hashes
+        self._hash = 0
+        for value in route_hashes:
+            self._hash ^= value
 
     def changed(self, route, route_index):
         """Return new changed solution with new route"""
         routes = list(self._routes)
         routes[route_index] = route
-        return Solution(routes)
+        route_hashes = list(self._route_hashes)
+        route_hashes[route_index] = route_hash(route)
+        return Solution(routes, route_hashes)
+
+    def appended(self, route):
+        """Return new solution with route added"""
+        return Solution(
+            self._routes + [route], self._route_hashes + [route_hash(route)])
+
+    def delete(self, route_index):
+        """Delete route from solution in-place"""
+        del self._routes[route_index]
+        del self._route_hashes[route_index]
+        self._hash = 0
+        for value in self._route_hashes:
+            self._hash ^= value
+        return self
 
     def __str__(self):
         """Serialize solution"""
@@ -48,12 +122,33 @@ class Solution(object):
         return len(self._routes)
 
     def __eq__(self, other):
-        """Equality operator"""
-        return self.routes == other.routes
+        """
+        Equality operator: O(1) fingerprint comparison, routes are compared
+        (regardless of their order) only if fingerprints match
+        """
+        if not isinstance(other, Solution):
+            return NotImplemented
+        if self._hash != other._hash:
+            return False
+        return sorted(self.ids()) == sorted(other.ids())
 
     def __ne__(self, other):
         """Inequality operator"""
-        return self.routes != other.routes
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    def __hash__(self):
+        """Hash operator"""
+        return self._hash
+
+    @property
+    def fingerprint(self):
+        """64-bit Zobrist hash of solution"""
+        return self._hash
+
+    def route_fingerprint(self, route_index):
+        """64-bit Zobrist hash of single route"""
+        return self._route_hashes[route_index]
 
     @property
     def routes(self):
@@ -96,10 +191,51 @@ class Solution(object):
             if not isinstance(route, list):
                 continue
             self._routes.append(route)
+            value = route_hash(route)
+            self._route_hashes.append(value)
+            self._hash ^= value
         return self
 
+def _route_schedule(graph, ids):
+    """
+    Schedule of route given as customer id array
+
+    Return service start times and latest arrival times: arriving to route[j]
+    not later than latest[j] keeps the rest of the route in time
+    """
+    ready = graph.ready_times[ids].tolist()
+    due = graph.due_dates[ids].tolist()
+    service = graph.service_times[ids].tolist()
+    costs = graph.gather_costs(ids[:-1], ids[1:]).tolist()
+    start = [0.0] * len(ids)
+    for j in range(1, len(ids)):
+        start[j] = max(start[j-1] + service[j-1] + costs[j-1], ready[j])
+    latest = [0.0] * len(ids)
+    latest[-1] = due[-1] - service[-1]
+    for j in range(len(ids)-2, -1, -1):
+        bound = latest[j+1] - service[j] - costs[j]
+        if ready[j] > bound:
+            latest[j] = -math.inf
+        else:
+            latest[j] = min(due[j] - service[j], bound)
+    return np.array(start), np.array(latest)
+
+
 class Objective(ABC):
-    """Objective function interface"""
+    """
+    Objective function interface
+
+    Objectives whose deltas under relocate/exchange moves equal distance
+    deltas set supports_batches, local search then uses evaluate_moves
+    """
+    supports_batches = False
+
+    def __init__(self):
+        """Init method"""
+        self._schedules = {}  # route fingerprint -> route arrays
+        # local search methods share objective between threads
+        self._schedules_lock = threading.Lock()
+
     @abstractmethod
     def __call__(self, graph, solution, md):
         """
@@ -128,14 +264,109 @@ class Objective(ABC):
         """Calculate route distance"""
         return sum(graph.costs[(route[i], route[i+1])] for i in range(len(route)-1))
 
+    def evaluate_moves(self, graph, solution, moves):
+        """
+        Evaluate batch of encoded moves
+
+        :param moves:
+            Integer array of (type, route a, position a, route b, position b)
+            rows, route b equal to len(solution) stands for a new route
+
+        Return arrays of distance deltas and feasibility flags, these are
+        objective deltas only if supports_batches is set
+        """
+        return self._distance_moves(graph, solution, moves)
+
+    def _route_arrays(self, graph, solution, route_index):
+        """Customer ids, start times, latest arrivals and load of route"""
+        if route_index == len(solution):
+            # new route
+            route = [graph.depot, graph.depot]
+            key = None
+        else:
+            route = solution[route_index]
+            key = solution.route_fingerprint(route_index)
+        with self._schedules_lock:
+            arrays = self._schedules.get(key)
+        if arrays is None:
+            ids = np.array([c.id for c in route])
+            start, latest = _route_schedule(graph, ids)
+            arrays = (ids, start, latest, graph.demands[ids].sum())
+            with self._schedules_lock:
+                if len(self._schedules) >= SCHEDULE_CACHE_SIZE:
+                    self._schedules.clear()
+                self._schedules[key] = arrays
+        return arrays
+
+    def _distance_moves(self, graph, solution, moves):
+        """
+        Distance deltas and exact feasibility of encoded moves
+
+        Only constraints of the changed routes are checked: time windows via
+        start times of the kept prefix and latest arrivals of the kept suffix,
+        capacity via route loads
+        """
+        moves = np.asarray(moves, dtype=np.int64).reshape(-1, 5)
+        kind, ra, pa, rb, pb = moves.T
+        used = np.unique(np.concatenate((ra, rb))).tolist()
+        tables = [self._route_arrays(graph, solution, ri) for ri in used]
+        lengths = np.array([len(t[0]) for t in tables])
+        offsets = np.zeros(len(solution) + 1, dtype=np.int64)
+        offsets[used] = np.cumsum(lengths) - lengths
+        loads = np.zeros(len(solution) + 1)
+        loads[used] = [t[3] for t in tables]
+        ids = np.concatenate([t[0] for t in tables])
+        start = np.concatenate([t[1] for t in tables])
+        latest = np.concatenate([t[2] for t in tables])
+        ga, gb = offsets[ra] + pa, offsets[rb] + pb
+        cost = graph.gather_costs
+        ready, due = graph.ready_times, graph.due_dates
+        service, demand = graph.service_times, graph.demands
+
+        def fits(prev, c, nxt, nxt_latest, g):
+            """Whether c fits between route[g-1] (prev) and nxt"""
+            arrival = start[g-1] + service[prev] + cost(prev, c)
+            arrival_next = np.maximum(arrival, ready[c]) + service[c] + \
+                cost(c, nxt)
+            return (arrival + service[c] <= due[c]) & \
+                (arrival_next <= nxt_latest)
+
+        a, prev_a, next_a = ids[ga], ids[ga-1], ids[ga+1]
+        deltas = np.zeros(len(moves))
+        feasible = (ra != rb) & (a != graph.depot.id)
+        # relocate
+        rel = kind == MOVE_RELOCATE
+        x, y = ids[gb-1], ids[gb]
+        deltas[rel] = (cost(prev_a, next_a) - cost(prev_a, a) - cost(a, next_a)
+            + cost(x, a) + cost(a, y) - cost(x, y))[rel]
+        arrival = start[ga-1] + service[prev_a] + cost(prev_a, next_a)
+        rel_ok = (arrival <= latest[ga+1])
+        rel_ok &= fits(x, a, y, latest[gb], gb)
+        rel_ok &= loads[rb] + demand[a] <= graph.capacity
+        rel_ok &= (rb < len(solution)) | (len(solution) < graph.vehicle_number)
+        # exchange
+        exc = kind == MOVE_EXCHANGE
+        b, prev_b, next_b = ids[gb], ids[gb-1], ids[(gb+1) % len(ids)]
+        deltas[exc] = (cost(prev_a, b) + cost(b, next_a) - cost(prev_a, a)
+            - cost(a, next_a) + cost(prev_b, a) + cost(a, next_b)
+            - cost(prev_b, b) - cost(b, next_b))[exc]
+        exc_ok = fits(prev_a, b, next_a, latest[ga+1], ga)
+        exc_ok &= fits(prev_b, a, next_b, latest[(gb+1) % len(ids)], gb)
+        exc_ok &= loads[ra] - demand[a] + demand[b] <= graph.capacity
+        exc_ok &= loads[rb] - demand[b] + demand[a] <= graph.capacity
+        exc_ok &= b != graph.depot.id
+        feasible &= np.where(rel, rel_ok, np.where(exc, exc_ok, False))
+        return deltas, feasible
+
 
 class CostMap(Matrix):
     """
     Costs between customers
     """
-    def __init__(self, customers):
+    def __init__(self, customers, costs=None):
         """Init method"""
-        super(CostMap, self).__init__(customers, CostMap.calculate_cost)
+        super(CostMap, self).__init__(
+            customers, CostMap.calculate_cost, values=costs)
 
     @staticmethod
     def calculate_cost(a, b):
@@ -143,6 +374,58 @@ class CostMap(Matrix):
         return math.sqrt((a.x - b.x)**2 + (a.y - b.y)**2)
 
 
+class EuclideanCostMap(object):
+    """
+    Costs between customers computed on demand from coordinates
+
+    Memory-light replacement for CostMap: stores O(n) coordinates instead of
+    the full n x n matrix
+    """
+    def __init__(self, customers):
+        """Init method"""
+        self.elements = OrderedDict()
+        for row in customers:
+            self.elements[Customer(row)] = None
+        by_id = sorted(self.elements.keys(), key=lambda c: c.id)
+        self._by_id = by_id
+        self._x = np.array([c.x for c in by_id], dtype=np.float64)
+        self._y = np.array([c.y for c in by_id], dtype=np.float64)
+        self._depot_customer = None
+        for c in by_id:
+            if c.is_depot:
+                self._depot_customer = c
+                break
+
+    def __len__(self):
+        """Length per row"""
+        return len(self.elements)
+
+    def __getitem__(self, key):
+        """Overload for operator[] getter"""
+        if isinstance(key, int):  # return customer by index
+            return self._by_id[key]
+        if isinstance(key, list) or isinstance(key, tuple):
+            a, b = key[0], key[1]
+            if not isinstance(a, Customer):
+                a, b = self._by_id[a], self._by_id[b]
+            return CostMap.calculate_cost(a, b)
+        return self.gather(key.id, np.arange(len(self._by_id))).tolist()
+
+    def gather(self, a, b):
+        """Costs between customer id arrays a and b (numpy broadcasting)"""
+        return np.sqrt((self._x[a] - self._x[b])**2 + (self._y[a] - self._y[b])**2)
+
+    @property
+    def depot(self):
+        """Return depot"""
+        return self._depot_customer
+
+    @property
+    def customers(self):
+        """Get customers"""
+        return self.elements
+
+
 class PenaltyMap(Matrix):
     """
     Penalties between customers
@@ -152,6 +435,27 @@ class PenaltyMap(Matrix):
         super(PenaltyMap, self).__init__(customers, lambda x, y: 0)
 
 
+class SparsePenaltyMap(object):
+    """
+    Penalties between customers stored only for penalized edges
+    """
+    def __init__(self):
+        """Init method"""
+        self.elements = {}
+
+    def __getitem__(self, key):
+        """Overload for operator[] getter"""
+        return self.elements.get((key[0].id, key[1].id), 0)
+
+    def __setitem__(self, key, value):
+        """Overload for operator[] setter"""
+        self.elements[(key[0].id, key[1].id)] = value
+
+    def __len__(self):
+        """Number of penalized edges"""
+        return len(self.elements)
+
+
 def _skip_lines(input_file, keyword):
     """
     Skip lines in input file until keyword is met
@@ -166,29 +470,250 @@ def _skip_lines(input_file, keyword):
     return input_file
 
 
+class _NeighboursMap(dict):
+    """
+    Map of neighbours of each customer built from precomputed neighbour
+    order on first access per customer
+    """
+    def __init__(self, by_id, cost_map, neighbour_order):
+        """Init method"""
+        super(_NeighboursMap, self).__init__()
+        self._by_id = by_id
+        self._cost_map = cost_map
+        self._order = neighbour_order
+
+    def __missing__(self, customer):
+        """Build neighbours list of customer"""
+        row = self._cost_map[customer]
+        neighbours = [(self._by_id[other], row[other])
+            for other in self._order[customer.id].tolist()]
+        self[customer] = neighbours
+        return neighbours
+
+
 class Graph(object):
     """
     Main class for graph abstraction
     """
-    def __init__(self, io_stream):
-        """Init method"""
-        _name, number, cap, input_data = Graph.parse_instance(io_stream)
+    def __init__(self, io_stream, memory_light=False, neighbours_k=None):
+        """
+        Init method
+
+        :param memory_light:
+            Do not materialize n x n structures: costs are computed on demand
+            and only neighbours_k nearest neighbours are stored per customer
+        """
+        self._build(*Graph.parse_instance(io_stream),
+            memory_light=memory_light, neighbours_k=neighbours_k)
+
+    @classmethod
+    def from_data(cls, name, number, capacity, input_data, memory_light=False,
+            neighbours_k=None):
+        """Construct graph from already parsed instance data"""
+        graph = cls.__new__(cls)
+        graph._build(name, number, capacity, input_data,
+            memory_light=memory_light, neighbours_k=neighbours_k)
+        return graph
+
+    @classmethod
+    def from_file(cls, instance_path, memory_light=False, neighbours_k=None,
+            use_cache=True):
+        """
+        Construct graph from instance file
+
+        Parsed data and derived structures (cost matrix, neighbour order) are
+        cached on disk next to the instance and memory-mapped on next load
+        """
+        if not use_cache:
+            with open(instance_path, 'r') as instance_file:
+                return cls(instance_file, memory_light, neighbours_k)
+        names = ['name', 'header', 'customers']
+        if not memory_light:
+            names += ['costs', 'neighbours']
+        path = instance_cache.cache_path(instance_path)
+        arrays = instance_cache.load(path, names)
+        if arrays is None:
+            with open(instance_path, 'r') as instance_file:
+                graph = cls(instance_file, memory_light, neighbours_k)
+            instance_cache.save(path, graph._cached_arrays())
+            return graph
+        graph = cls.__new__(cls)
+        number, capacity = arrays['header'].tolist()
+        graph._build(str(arrays['name']), number, capacity,
+            arrays['customers'], memory_light=memory_light,
+            neighbours_k=neighbours_k, costs=arrays.get('costs'),
+            neighbour_order=arrays.get('neighbours'))
+        return graph
+
+    def _cached_arrays(self):
+        """Return arrays to be stored in instance cache"""
+        arrays = {
+            'name': np.array(self._instance_name),
+            'header': np.array([self._v_number, self._v_capacity]),
+            'customers': np.array([c.values for c in self._by_id]),
+        }
+        if not self._memory_light:
+            arrays['costs'] = self._distance_matrix
+            arrays['neighbours'] = np.array(
+                [[other.id for other, _ in self._neighbours_map[c]]
+                    for c in self._by_id], dtype=np.int32)
+        return arrays
+
+    def _build(self, _name, number, cap, input_data, memory_light=False,
+            neighbours_k=None, costs=None, neighbour_order=None):
+        """
+        Set up graph data structures from parsed instance
+
+        :param costs:
+            Precomputed cost matrix indexed by customer id
+        :param neighbour_order:
+            Precomputed ids of other customers sorted by cost, per customer
+        """
         self._instance_name = _name.lower()
         self._v_number = number
         self._v_capacity = cap
+        self._memory_light = memory_light
         # input data processing:
         # expecting full graph!
         self._input_data = input_data
-        self.cost_map = CostMap(input_data)
+        if memory_light:
+            self.cost_map = EuclideanCostMap(input_data)
+        elif costs is not None:
+            # scalar lookups go through Python floats (numpy scalars are
+            # slow), the (memory-mapped) matrix is kept for gather_costs
+            self.cost_map = CostMap(input_data, costs.tolist())
+        else:
+            self.cost_map = CostMap(input_data)
         self.c_number = len(input_data)
+        by_id = sorted(self.customers, key=lambda c: c.id)
+        self._by_id = by_id
+        self._avg_cap = sum(c.demand for c in self.customers) / self._v_number
+        # array views indexed by customer id for vectorized evaluation
+        self._attributes = np.array([c.values for c in by_id], dtype=np.float64)
+        if memory_light:
+            self._distance_matrix = None
+            self._arc_feasible = None
+            self._arc_mask = None
+            self._capacity_compatible = None
+            self._neighbours_map = self._nearest_neighbours(
+                neighbours_k or NEIGHBOURS_K)
+            return
         # find distance to neighbours of each customer
         self._neighbours_map = {}
-        for customer in self.cost_map.customers:
-            self._neighbours_map[customer] = sorted(
-                [(other, self.cost_map[[customer, other]]) \
-                    for other in self.customers if other != customer],
-                key=lambda x: x[1])
-        self._avg_cap = sum(c.demand for c in self.customers) / self._v_number
+        if neighbour_order is not None:
+            self._neighbours_map = _NeighboursMap(
+                by_id, self.cost_map, neighbour_order)
+        else:
+            for customer in self.cost_map.customers:
+                self._neighbours_map[customer] = sorted(
+                    [(other, self.cost_map[[customer, other]]) \
+                        for other in self.customers if other != customer],
+                    key=lambda x: x[1])
+        if costs is not None:
+            self._distance_matrix = costs
+        else:
+            self._distance_matrix = np.array(
+                [self.cost_map[c] for c in by_id], dtype=np.float64)
+        # pruning masks indexed by customer id: a move that creates an
+        # infeasible arc or puts incompatible customers together is never
+        # feasible, so it can be skipped before constructing a candidate
+        ids = np.arange(len(by_id))
+        self._arc_mask = self._arc_time_feasible(ids[:, None], ids[None, :])
+        self._arc_feasible = self._arc_mask.tolist()
+        demands = self.demands
+        self._capacity_compatible = (
+            demands[:, None] + demands[None, :] <= self._v_capacity).tolist()
+
+    def _nearest_neighbours(self, k, chunk_size=256):
+        """
+        Find k nearest neighbours of each customer, computed in chunks
+
+        Depot is always kept in the list so that relocate is able to open
+        new routes
+        """
+        k = min(k, len(self._by_id) - 1)
+        ids = np.arange(len(self._by_id))
+        depot_id = self.depot.id
+        neighbours = {}
+        for start in range(0, len(ids), chunk_size):
+            rows = ids[start:start+chunk_size]
+            costs = self.gather_costs(rows[:, None], ids[None, :])
+            costs[np.arange(len(rows)), rows] = np.inf  # exclude self
+            nearest = np.argpartition(costs, k - 1, axis=1)[:, :k]
+            for row, cols in zip(rows, nearest):
+                row_costs = costs[row - start]
+                cols = set(cols.tolist())
+                if row != depot_id:
+                    cols.add(depot_id)
+                neighbours[self._by_id[row]] = sorted(
+                    [(self._by_id[c], float(row_costs[c])) for c in cols],
+                    key=lambda x: x[1])
+        return neighbours
+
+    def _arc_time_feasible(self, a, b):
+        """
+        Check whether b can be served right after a in any route, customer
+        ids are given as arrays (numpy broadcasting)
+
+        Service at a starts no earlier than a.ready_time (vehicle leaves the
+        depot at 0), so arrival at b is bounded from below
+        """
+        earliest_start = np.where(a == self.depot.id, 0, self.ready_times[a])
+        arrival = earliest_start + self.service_times[a]
+        arrival = arrival + self.gather_costs(a, b)
+        return arrival + self.service_times[b] <= self.due_dates[b]
+
+    def arc_feasible(self, a, b):
+        """Check whether arc a -> b satisfies time windows"""
+        if self._arc_feasible is None:
+            earliest_start = 0 if a.is_depot else a.ready_time
+            arrival = earliest_start + a.service_time
+            arrival += self.cost_map[(a, b)]
+            return arrival + b.service_time <= b.due_date
+        return self._arc_feasible[a.id][b.id]
+
+    def fits_together(self, a, b):
+        """Check whether a and b can be served by the same vehicle"""
+        if self._capacity_compatible is None:
+            return a.demand + b.demand <= self._v_capacity
+        return self._capacity_compatible[a.id][b.id]
+
+    def gather_costs(self, a, b):
+        """Costs between customer id arrays a and b (numpy broadcasting)"""
+        if self._distance_matrix is None:
+            return self.cost_map.gather(a, b)
+        return self._distance_matrix[a, b]
+
+    def gather_arc_feasible(self, a, b):
+        """Arc feasibility mask between customer id arrays a and b"""
+        if self._arc_mask is None:
+            return self._arc_time_feasible(a, b)
+        return self._arc_mask[a, b]
+
+    @property
+    def memory_light(self):
+        """Whether n x n structures are not materialized"""
+        return self._memory_light
+
+    @property
+    def demands(self):
+        """Demands array indexed by customer id"""
+        return self._attributes[:, 3]
+
+    @property
+    def ready_times(self):
+        """Ready times array indexed by customer id"""
+        return self._attributes[:, 4]
+
+    @property
+    def due_dates(self):
+        """Due dates array indexed by customer id"""
+        return self._attributes[:, 5]
+
+    @property
+    def service_times(self):
+        """Service times array indexed by customer id"""
+        return self._attributes[:, 6]
 
     @property
     def name(self):
@@ -6,6 +6,9 @@ Internal library for local search strategies
 
 import unittest
 import copy
+import random
+import multiprocessing
+import numpy as np
 
 # local imports
 from contextlib import contextmanager
@@ -20,14 +23,20 @@ def import_from(rel_path):
     sys.path.pop(0)
 
 with import_from('../'):
+    from lib.graph import Graph
     from lib.graph import Solution
     from lib.graph import Objective
+    from lib.graph import MOVE_RELOCATE
+    from lib.graph import MOVE_EXCHANGE
     from lib.customer import Customer
     from lib.constraints import satisfies_all_constraints
 
 
+PAIR_STALL_ROUNDS = 3  # route pair rounds without improvement before stop
+
+
 # [1] 2-opt | credits: https://en.wikipedia.org/wiki/2-opt
-def _two_opt_swap(route, i, k):
+def two_opt_swap(route, i, k):
     """Perform 2-opt swap on route for i and k"""
     if i >= len(route) or k >= len(route):
         raise ValueError('index out of range')
@@ -52,7 +61,7 @@ def _two_opt_on_route(graph, objective, solution, route_index, md):
             if found_new_best:  # fast loop break
                 break
             for k in range(i + 1, len(route) - 1):
-                new_route = _two_opt_swap(route, i, k)
+                new_route = two_opt_swap(route, i, k)
                 new_S = solution.changed(_reconstruct(graph, new_route), route_index)
                 O = objective(graph, new_S, md)
                 if O < curr_best_O and satisfies_all_constraints(graph, new_S):
@@ -66,14 +75,135 @@ def _two_opt_on_route(graph, objective, solution, route_index, md):
     return _reconstruct(graph, route)
 
 
+def _route_start_times(graph, ids):
+    """Service start times along route given as customer id array"""
+    ready = graph.ready_times
+    service = graph.service_times
+    arc_costs = graph.gather_costs(ids[:-1], ids[1:])
+    start = np.zeros(len(ids))
+    for j in range(1, len(ids)):
+        arrival = start[j-1] + service[ids[j-1]] + arc_costs[j-1]
+        start[j] = max(arrival, ready[ids[j]])
+    return start
+
+
+def two_opt_deltas(graph, ids):
+    """
+    Evaluate all 2-opt moves of route at once
+
+    Route is given as customer id array with depots at both ends. Entry
+    [i-1, k-1] corresponds to reversal of route[i:k+1], 1 <= i < k <= m-1.
+    Returns matrix of distance deltas and mask of moves that pass the
+    necessary time window checks:
+        * all newly created arcs are feasible on their own
+        * route[k] is served in time when reached right after route[i-1]
+    """
+    prev, inner, nxt = ids[:-2], ids[1:-1], ids[2:]
+    # costs are symmetric: reversed segment keeps its length
+    deltas = graph.gather_costs(prev[:, None], inner[None, :])
+    deltas += graph.gather_costs(inner[:, None], nxt[None, :])
+    deltas -= graph.gather_costs(prev, inner)[:, None]
+    deltas -= graph.gather_costs(inner, nxt)[None, :]
+    mask = np.triu(np.ones(deltas.shape, dtype=bool), 1)
+    mask &= graph.gather_arc_feasible(prev[:, None], inner[None, :])
+    mask &= graph.gather_arc_feasible(inner[:, None], nxt[None, :])
+    # reversed inner arcs route[j+1] -> route[j], i <= j < k
+    bad_reversed = ~graph.gather_arc_feasible(inner[1:], inner[:-1])
+    bad_before = np.concatenate(([0], np.cumsum(bad_reversed)))
+    mask &= (bad_before[None, :] - bad_before[:, None]) == 0
+    # time window slack: prefix up to route[i-1] is kept as is
+    start = _route_start_times(graph, ids)
+    departure = start[:-2] + graph.service_times[prev]
+    arrival = departure[:, None] + graph.gather_costs(
+        prev[:, None], inner[None, :])
+    mask &= arrival + graph.service_times[inner][None, :] <= \
+        graph.due_dates[inner][None, :]
+    return deltas, mask
+
+
+def _two_opt_best_on_route(graph, objective, solution, route_index, md):
+    """
+    Perform best-improvement 2-opt strategy for single route
+
+    All moves of the route are evaluated with numpy per pass, the best one
+    that is verified to be feasible and improving is applied
+    """
+    route = solution[route_index]
+    while len(route) > 3:
+        ids = np.array([c.id for c in route])
+        deltas, mask = two_opt_deltas(graph, ids)
+        candidates = np.flatnonzero(mask & (deltas < -1e-9))
+        found_new_best = False
+        curr_best_O = objective(graph, solution, md)
+        for flat in candidates[np.argsort(deltas.flat[candidates])]:
+            i, k = np.unravel_index(flat, deltas.shape)
+            new_route = two_opt_swap(route, i + 1, k + 1)
+            new_S = solution.changed(new_route, route_index)
+            if objective(graph, new_S, md) >= curr_best_O:
+                continue
+            if not satisfies_all_constraints(graph, new_S, route_index):
+                continue
+            route = new_route
+            solution = new_S
+            found_new_best = True
+            break
+        if not found_new_best:
+            break
+    return route
+
+
 def two_opt(graph, objective, solution, md=None):
-    """Perform 2-opt operation on solution"""
+    """
+    Perform 2-opt operation on solution
+
+    Note: md['two_opt'] == 'best' switches to vectorized best-improvement
+    mode, first-improvement is used otherwise
+    """
+    on_route = _two_opt_on_route
+    if md and md.get('two_opt') == 'best':
+        on_route = _two_opt_best_on_route
     routes = [None] * len(solution)
     for i in range(len(solution)):
-        routes[i] = _two_opt_on_route(graph, objective, solution, i, md)
+        routes[i] = on_route(graph, objective, solution, i, md)
     return Solution(routes)
 
 
+# batched evaluation
+def _supports_batches(objective):
+    """Check whether objective deltas can be evaluated by evaluate_moves"""
+    return isinstance(objective, Objective) and objective.supports_batches
+
+
+def _positions(graph, solution):
+    """
+    Route index and position of each customer as array indexed by customer
+    id, depots (and unknown ids) are marked with -1
+    """
+    size = max(c.id for c in graph.customers) + 1
+    positions = np.full((size, 2), -1, dtype=np.int64)
+    for ri, route in enumerate(solution):
+        for ci in range(1, len(route) - 1):
+            positions[route[ci].id] = (ri, ci)
+    return positions
+
+
+def _apply_best(graph, objective, solution, moves, apply, md=None):
+    """
+    Evaluate encoded moves in one batch and apply the best improving one
+
+    Changed routes are verified before the move is accepted. Return new
+    solution or None if no move improves
+    """
+    moves = np.array(moves, dtype=np.int64).reshape(-1, 5)
+    deltas, feasible = objective.evaluate_moves(graph, solution, moves)
+    candidates = np.flatnonzero(feasible & (deltas < -1e-9))
+    for index in candidates[np.argsort(deltas[candidates], kind='stable')]:
+        new_S, changed = apply(solution, *moves[index, 1:].tolist())
+        if all(satisfies_all_constraints(graph, new_S, ri) for ri in changed):
+            return new_S
+    return None
+
+
 # [2] relocate operation
 def _distance_on_route(graph, route, i, k):
     """
@@ -102,7 +232,7 @@ def _delete_loops(solution):
             to_pop.append(i)
     # delete in reverse order not to screw the indexing
     for route_index in reversed(to_pop):
-        del solution.routes[route_index]
+        solution.delete(route_index)
     return solution
 
 
@@ -123,10 +253,13 @@ def _relocate_one(customer, graph, objective, S, md=None):
             # else: skip depot -> can't relocate
             if len(S.routes) >= graph.vehicle_number:
                 continue
-            new_routes = copy.deepcopy(S.routes)
-            new_routes.append(_reconstruct(graph, [customer]))
-            new_routes[c_route_index].pop(c_index)
-            new_S = Solution(new_routes)
+            if not graph.arc_feasible(graph.depot, customer) or \
+                    not graph.arc_feasible(customer, graph.depot):
+                continue
+            new_customer_route = list(S[c_route_index])
+            new_customer_route.pop(c_index)
+            new_S = S.changed(new_customer_route, c_route_index).appended(
+                _reconstruct(graph, [customer]))
             new_O = objective(graph, new_S, md)
             if new_O > curr_best_O:  # skip if not better
                 continue
@@ -140,6 +273,9 @@ def _relocate_one(customer, graph, objective, S, md=None):
         if c_route_index == n_route_index:
             # no need to relocate within a single route
             continue
+        if not graph.fits_together(customer, neighbour):
+            # capacity is violated by this pair alone
+            continue
         customer_route = S.routes[c_route_index]
         neighbour_route = S.routes[n_route_index]
         if _is_loop(customer_route) or _is_loop(neighbour_route):
@@ -160,13 +296,20 @@ def _relocate_one(customer, graph, objective, S, md=None):
             # no need to relocate anything
             continue
         # found better
-        new_routes = copy.deepcopy(S.routes)
         if dist_customer_neighbour_prev < dist_customer_neighbour_next:
-            new_routes[n_route_index].insert(n_index, customer)
+            insert_index = n_index
         else:
-            new_routes[n_route_index].insert(n_index+1, customer)
-        new_routes[c_route_index].pop(c_index)
-        new_S = Solution(new_routes)
+            insert_index = n_index + 1
+        if not graph.arc_feasible(neighbour_route[insert_index-1], customer) \
+                or not graph.arc_feasible(customer, neighbour_route[insert_index]):
+            # time windows are violated around inserted customer
+            continue
+        new_neighbour_route = list(neighbour_route)
+        new_neighbour_route.insert(insert_index, customer)
+        new_customer_route = list(customer_route)
+        new_customer_route.pop(c_index)
+        new_S = S.changed(new_neighbour_route, n_route_index)
+        new_S = new_S.changed(new_customer_route, c_route_index)
         if objective(graph, new_S, md) >= curr_best_O:  # no need to relocate
             continue
         if not satisfies_all_constraints(graph, new_S):
@@ -176,13 +319,74 @@ def _relocate_one(customer, graph, objective, S, md=None):
     return _delete_loops(S)
 
 
+def relocate_move(solution, ri, ci, n_ri, n_ci):
+    """Apply encoded relocate move, return solution and changed routes"""
+    route = list(solution[ri])
+    customer = route.pop(ci)
+    if n_ri == len(solution):
+        # new route
+        new_S = solution.changed(route, ri).appended(
+            [route[0], customer, route[0]])
+    else:
+        neighbour_route = list(solution[n_ri])
+        neighbour_route.insert(n_ci, customer)
+        new_S = solution.changed(route, ri).changed(neighbour_route, n_ri)
+    return new_S, (ri, n_ri)
+
+
+def _relocate_one_batched(customer, graph, objective, S, positions, md=None):
+    """Relocate single customer evaluating all neighbour moves at once"""
+    if customer == graph.depot:  # do not relocate depots
+        return S
+    c_route_index, c_index = positions[customer.id]
+    if c_route_index < 0:
+        # customer does not belong to any route. shouldn't happen
+        raise IndexError('route for customer not found')
+    moves = []
+    for neighbour, _ in graph.neighbours[customer]:
+        if neighbour == graph.depot:
+            # new route, feasibility checks vehicle number
+            moves.append((MOVE_RELOCATE, c_route_index, c_index, len(S), 1))
+            continue
+        n_route_index, n_index = positions[neighbour.id]
+        if n_route_index == c_route_index:
+            continue
+        if not graph.fits_together(customer, neighbour):
+            continue
+        # insert before and after neighbour
+        moves.append(
+            (MOVE_RELOCATE, c_route_index, c_index, n_route_index, n_index))
+        moves.append(
+            (MOVE_RELOCATE, c_route_index, c_index, n_route_index, n_index+1))
+    if not moves:
+        return S
+    new_S = _apply_best(graph, objective, S, moves, relocate_move, md)
+    return S if new_S is None else _delete_loops(new_S)
+
+
 def relocate(graph, objective, solution, md=None):
     """
     Perform relocate operation on solution
 
     Move a customer from one route to another if makes sense.
     Note: Can relocate to an "empty" route.
+    Note: objectives with supports_batches get all candidate moves of
+    a customer evaluated in one batch
+    Note: md['pair_pool'] switches to parallel search over route pairs (no
+    relocation to an "empty" route there)
     """
+    if _pair_search_enabled(objective, md):
+        return _pair_search(graph, solution, md['pair_pool'], MOVE_RELOCATE,
+            random_generator(md))
+    if _supports_batches(objective):
+        positions = _positions(graph, solution).tolist()
+        for customer in graph.customers:
+            new_solution = _relocate_one_batched(
+                customer, graph, objective, solution, positions, md)
+            if new_solution is not solution:
+                solution = new_solution
+                positions = _positions(graph, solution).tolist()
+        return solution
     for customer in graph.customers:
         solution = _relocate_one(customer, graph, objective, solution, md)
     return solution
@@ -203,6 +407,27 @@ def swap_nodes(route_a, route_b, ci_a, ci_b):
     return a, b
 
 
+def _can_swap(graph, route_a, route_b, ci_a, ci_b):
+    """
+    Check whether swapping route_a[ci_a] and route_b[ci_b] can be feasible
+
+    Only arcs and pairs created by the swap are inspected
+    """
+    a, b = route_a[ci_a], route_b[ci_b]
+    arc_feasible = graph.arc_feasible
+    if not arc_feasible(route_a[ci_a-1], b) or \
+            not arc_feasible(b, route_a[ci_a+1]):
+        return False
+    if not arc_feasible(route_b[ci_b-1], a) or \
+            not arc_feasible(a, route_b[ci_b+1]):
+        return False
+    fits_together = graph.fits_together
+    return fits_together(b, route_a[ci_a-1]) and \
+        fits_together(b, route_a[ci_a+1]) and \
+        fits_together(a, route_b[ci_b-1]) and \
+        fits_together(a, route_b[ci_b+1])
+
+
 def _sort_solution_by_objective(graph, O, S):
     """Sort routes by impact on objective function in descending order"""
     return sorted([ri for ri in range(len(S))],
@@ -229,6 +454,8 @@ def _exchange_one(customer, graph, objective, S, md=None):
         for i, other in enumerate(route):
             if other == graph.depot:  # skip depot
                 continue
+            if not _can_swap(graph, customer_route, route, c_index, i):
+                continue
             new_customer_route, new_route = swap_nodes(
                 customer_route, route, c_index, i)
             new_S = S.changed(new_customer_route, c_route_index)
@@ -243,17 +470,181 @@ def _exchange_one(customer, graph, objective, S, md=None):
     return S
 
 
+def exchange_move(solution, ri, ci, o_ri, o_ci):
+    """Apply encoded exchange move, return solution and changed routes"""
+    route, other_route = list(solution[ri]), list(solution[o_ri])
+    route[ci], other_route[o_ci] = other_route[o_ci], route[ci]
+    return solution.changed(route, ri).changed(other_route, o_ri), (ri, o_ri)
+
+
+def _exchange_one_batched(customer, graph, objective, S, positions, md=None):
+    """Swap single customer evaluating swaps with all other routes at once"""
+    if customer == graph.depot:  # do not relocate depots
+        return S
+    c_route_index, c_index = positions[customer.id]
+    if c_route_index < 0:
+        # customer does not belong to any route. shouldn't happen
+        raise IndexError('route for customer not found')
+    others = positions[(positions[:, 0] >= 0) &
+        (positions[:, 0] != c_route_index)]
+    if not len(others):
+        return S
+    moves = np.empty((len(others), 5), dtype=np.int64)
+    moves[:, 0] = MOVE_EXCHANGE
+    moves[:, 1] = c_route_index
+    moves[:, 2] = c_index
+    moves[:, 3:] = others
+    new_S = _apply_best(graph, objective, S, moves, exchange_move, md)
+    return S if new_S is None else new_S
+
+
 def exchange(graph, objective, solution, md=None):
     """
     Perform exchange operation on solution
 
     Swap customer visits in different vehicle routes
+    Note: objectives with supports_batches get all candidate swaps of
+    a customer evaluated in one batch
+    Note: md['pair_pool'] switches to parallel search over route pairs
     """
+    if _pair_search_enabled(objective, md):
+        return _pair_search(graph, solution, md['pair_pool'], MOVE_EXCHANGE,
+            random_generator(md))
+    if _supports_batches(objective):
+        positions = _positions(graph, solution)
+        for customer in graph.customers:
+            new_solution = _exchange_one_batched(
+                customer, graph, objective, solution, positions, md)
+            if new_solution is not solution:
+                solution = new_solution
+                positions = _positions(graph, solution)
+        return Solution(solution.routes)
     for customer in graph.customers:
         solution = _exchange_one(customer, graph, objective, solution, md)
     return Solution(solution.routes)
 
 
+# parallel search over route pairs
+class DistanceObjective(Objective):
+    """Distance objective (route pair workers, checks and tests)"""
+    supports_batches = True
+
+    def __call__(self, graph, solution, md):
+        """operator() overload"""
+        return self._distance(graph, solution)
+
+
+_PAIR_WORKER = {}  # graph and objective of route pair worker process
+
+
+def _init_pair_worker(name, number, capacity, data, memory_light):
+    """Build graph once per route pair worker process"""
+    graph = Graph.from_data(name, number, capacity, data, memory_light)
+    _PAIR_WORKER['graph'] = graph
+    _PAIR_WORKER['by_id'] = {c.id: c for c in graph.customers}
+    _PAIR_WORKER['objective'] = DistanceObjective()
+
+
+def route_pair_pool(graph, workers):
+    """
+    Return process pool searching route pairs of graph
+
+    Note: the caller owns the pool and is responsible for terminating it
+    """
+    data = [c.values for c in sorted(graph.customers, key=lambda c: c.id)]
+    return multiprocessing.Pool(workers, initializer=_init_pair_worker,
+        initargs=(graph.name, graph.vehicle_number, graph.capacity, data,
+            graph.memory_light))
+
+
+def random_generator(md):
+    """Random generator of method specific data (unseeded if not given)"""
+    rng = md.get('random') if md else None
+    return rng if rng is not None else random.Random()
+
+
+def _pair_search_enabled(objective, md):
+    """Check whether route pair search is requested and applicable"""
+    return bool(md) and md.get('pair_pool') is not None and \
+        _supports_batches(objective)
+
+
+def _pair_moves(solution, kind):
+    """Encode all moves of given kind between two routes of solution"""
+    moves = []
+    for ra, rb in ((0, 1), (1, 0)):
+        # relocate: before any non-depot position of b, including final depot
+        b_end = len(solution[rb]) - (1 if kind == MOVE_RELOCATE else 2)
+        pa, pb = np.meshgrid(np.arange(1, len(solution[ra]) - 1),
+            np.arange(1, b_end + 1), indexing='ij')
+        block = np.empty((pa.size, 5), dtype=np.int64)
+        block[:, 0] = kind
+        block[:, 1] = ra
+        block[:, 2] = pa.ravel()
+        block[:, 3] = rb
+        block[:, 4] = pb.ravel()
+        moves.append(block)
+        if kind == MOVE_EXCHANGE:
+            # exchange is symmetric
+            break
+    return np.concatenate(moves)
+
+
+def _improve_pair(ids_a, ids_b, kind):
+    """
+    Apply best improving moves between two routes until none is left (route
+    pair worker process entry point)
+
+    Return new routes as customer id lists and total distance gain
+    """
+    graph = _PAIR_WORKER['graph']
+    by_id = _PAIR_WORKER['by_id']
+    objective = _PAIR_WORKER['objective']
+    apply = relocate_move if kind == MOVE_RELOCATE else exchange_move
+    S = Solution([[by_id[i] for i in ids_a], [by_id[i] for i in ids_b]])
+    gain = 0.0
+    while len(S[0]) > 2 and len(S[1]) > 2:
+        new_S = _apply_best(graph, objective, S, _pair_moves(S, kind), apply)
+        if new_S is None:
+            break
+        gain += objective(graph, S, None) - objective(graph, new_S, None)
+        S = new_S
+    return [c.id for c in S[0]], [c.id for c in S[1]], gain
+
+
+def _pair_search(graph, solution, pool, kind, rng):
+    """
+    Search disjoint route pairs in parallel
+
+    Routes are randomly paired each round so that every route appears in one
+    pair only, hence all improved pairs are applied together. Stops after
+    PAIR_STALL_ROUNDS rounds in a row without improvement
+    """
+    by_id = {c.id: c for c in graph.customers}
+    stall = 0
+    while stall < PAIR_STALL_ROUNDS and len(solution) > 1:
+        order = list(range(len(solution)))
+        rng.shuffle(order)
+        pairs = list(zip(order[0::2], order[1::2]))
+        results = pool.starmap(_improve_pair, [
+            ([c.id for c in solution[a]], [c.id for c in solution[b]], kind)
+            for a, b in pairs])
+        improved = False
+        for (a, b), (ids_a, ids_b, gain) in zip(pairs, results):
+            if gain <= 1e-9:
+                continue
+            solution = solution.changed([by_id[i] for i in ids_a], a)
+            solution = solution.changed([by_id[i] for i in ids_b], b)
+            improved = True
+        if improved:
+            # solution is a new object here: safe to delete in-place
+            solution = _delete_loops(solution)
+            stall = 0
+        else:
+            stall += 1
+    return solution
+
+
 # [4] cross operation
 def cross(graph, objective, solution, md=None):
     """
@@ -323,6 +714,12 @@ class TestGraph(object):
         self.vehicle_capacity = 100
         self.capacity = 100
 
+    def arc_feasible(self, a, b):
+        return True
+
+    def fits_together(self, a, b):
+        return True
+
 
 def distance(graph, solution, md):
     """Calculate overall distance"""
@@ -341,7 +738,7 @@ class LssTests(unittest.TestCase):
         expected = ['A', 'B', 'D', 'C']
         self.assertEqual(
             expected,
-            _two_opt_swap(test_route, 1, 2))
+            two_opt_swap(test_route, 1, 2))
 
     def test_two_opt_swap_works_nodes_between(self):
         """Test 2-opt swap works when nodes are between"""
@@ -349,7 +746,7 @@ class LssTests(unittest.TestCase):
         expected = ['A', 'B', 'E', 'X', 'D', 'C']
         self.assertEqual(
             expected,
-            _two_opt_swap(test_route, 1, 4))
+            two_opt_swap(test_route, 1, 4))
 
     def test_two_opt_works(self):
         """Test 2-opt works"""
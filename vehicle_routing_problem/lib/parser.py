@@ -14,6 +14,7 @@ def import_from(rel_path):
 
 with import_from('.'):
     from lib.search_utils import local_search_methods
+    from lib.search_utils import local_search_modes
 
 
 def basic_parser():
@@ -38,4 +39,34 @@ def basic_parser():
         nargs='*',
         choices=local_search_methods().keys(),
         default=[])
+    parser.add_argument('--two-opt',
+        help='2-opt improvement strategy: first (scalar) or best (vectorized)',
+        choices=['first', 'best'],
+        default='first')
+    parser.add_argument('--ls-mode',
+        help='How local search heuristics are combined: all (run each, keep '
+            'best), vnd (chain), adaptive (pick by credit)',
+        choices=local_search_modes().keys(),
+        default='all')
+    parser.add_argument('--pair-workers',
+        help='Run relocate and exchange on disjoint route pairs in N worker '
+            'processes (0: off)',
+        type=int,
+        default=0)
+    parser.add_argument('--no-cache',
+        action='store_true',
+        help='Do not use on-disk cache of parsed instances')
+    parser.add_argument('--memory-light',
+        action='store_true',
+        help='Compute costs on demand and keep only nearest neighbours '
+            '(for very large instances)')
+    parser.add_argument('--seed',
+        help='Random seed',
+        type=int,
+        default=11)
+    parser.add_argument('--neighbours',
+        help='Number of nearest neighbours kept per customer in memory-light '
+            'mode',
+        type=int,
+        default=None)
     return parser
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+"""
+Internal library for perturbation moves
+
+Feasible-looking moves are generated once per route state (identified by route
+fingerprints) and kept in a size-capped pool. Routes untouched by local search
+keep their fingerprints, so their moves are reused between iterations and only
+changed routes pay for move generation
+"""
+
+import unittest
+import random
+
+# local imports
+from contextlib import contextmanager
+@contextmanager
+def import_from(rel_path):
+    """Add module import relative path to sys.path"""
+    import sys
+    import os
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, os.path.join(cur_dir, rel_path))
+    yield
+    sys.path.pop(0)
+
+with import_from('../'):
+    from lib.graph import Graph
+    from lib.search_utils import LruCache
+    import lib.search_utils as search
+    from lib.search_utils import construct_initial_solution
+    from lib.constraints import satisfies_all_constraints
+    from lib.constraints import route_satisfies_constraints
+
+
+SWAP = 0  # double swap: reverse swap of two adjacent customers per route
+BRIDGE = 1  # double bridge: exchange of two adjacent segments of route
+
+
+def double_swap(route_a, route_b, ci_a, ci_b):
+    """Reverse swap customers a[ci_a], a[ci_a+1] with b[ci_b], b[ci_b+1]"""
+    new_route_a = route_a[:ci_a] + [route_b[ci_b+1], route_b[ci_b]] + \
+        route_a[ci_a+2:]
+    new_route_b = route_b[:ci_b] + [route_a[ci_a+1], route_a[ci_a]] + \
+        route_b[ci_b+2:]
+    return new_route_a, new_route_b
+
+
+def double_bridge(route, i, j, k):
+    """Exchange adjacent segments route[i:j] and route[j:k]"""
+    return route[:i] + route[j:k] + route[i:j] + route[k:]
+
+
+def _arcs_feasible(graph, arcs):
+    """Check whether all arcs pass pruning masks"""
+    for a, b in arcs:
+        if not graph.arc_feasible(a, b) or not graph.fits_together(a, b):
+            return False
+    return True
+
+
+def can_double_swap(graph, route_a, route_b, ci_a, ci_b):
+    """
+    Check whether double swap can be feasible judging by newly created arcs
+    only
+    """
+    # route a: .. a[ci_a-1] -> b[ci_b+1] -> b[ci_b] -> a[ci_a+2] ..
+    # route b: .. b[ci_b-1] -> a[ci_a+1] -> a[ci_a] -> b[ci_b+2] ..
+    return _arcs_feasible(graph, [
+        (route_a[ci_a-1], route_b[ci_b+1]),
+        (route_b[ci_b+1], route_b[ci_b]),
+        (route_b[ci_b], route_a[ci_a+2]),
+        (route_b[ci_b-1], route_a[ci_a+1]),
+        (route_a[ci_a+1], route_a[ci_a]),
+        (route_a[ci_a], route_b[ci_b+2]),
+    ])
+
+
+def can_double_bridge(graph, route, i, j, k):
+    """
+    Check whether double bridge can be feasible judging by newly created arcs
+    only
+    """
+    # .. route[i-1] -> route[j] .. route[k-1] -> route[i] .. route[j-1] ->
+    # route[k] ..
+    return _arcs_feasible(graph, [
+        (route[i-1], route[j]),
+        (route[k-1], route[i]),
+        (route[j-1], route[k]),
+    ])
+
+
+class PerturbationPool(object):
+    """
+    Pool of perturbation moves
+
+    Double swaps are enumerated per (ordered) pair of routes, double bridges
+    are sampled per route. Moves are stored as position tuples keyed by route
+    fingerprints, so a stored move is valid as long as the routes it was
+    generated for are unchanged. Sampled moves are removed from the pool and
+    checked exactly on the changed routes only. Applied moves are remembered
+    in a size-capped history of move hashes
+    """
+    def __init__(self, graph, history_size=4096, pool_size=1024,
+            bridge_samples=64, attempts=64, swap_share=0.5, seed=None):
+        """Init method"""
+        self._graph = graph
+        self._moves = LruCache(maxsize=pool_size)
+        self._weights = LruCache(maxsize=pool_size)
+        self._history = LruCache(maxsize=history_size)
+        self._bridge_samples = bridge_samples
+        self._attempts = attempts
+        self._swap_share = swap_share
+        self._random = random.Random(seed)
+
+    @property
+    def history(self):
+        """Hashes of applied moves"""
+        return self._history
+
+    def _route_weight(self, objective, solution, ri):
+        """Impact of route on objective (cached per route state)"""
+        key = solution.route_fingerprint(ri)
+        weight = self._weights.get(key)
+        if weight is None:
+            weight = objective(self._graph, solution, {'ri': ri})
+            self._weights[key] = weight
+        return weight
+
+    def _pick_route(self, objective, solution):
+        """
+        Pick route index: as O -> min, routes with higher objective are bad
+        and perturbed more often
+        """
+        weights = [self._route_weight(objective, solution, ri)
+            for ri in range(len(solution))]
+        if sum(weights) <= 0:
+            return self._random.randrange(len(solution))
+        return self._random.choices(range(len(solution)), weights=weights)[0]
+
+    def _swap_moves(self, route_a, route_b):
+        """Enumerate double swaps of two routes passing pruning masks"""
+        return [(ci_a, ci_b)
+            for ci_a in range(1, len(route_a) - 2)
+            for ci_b in range(1, len(route_b) - 2)
+            if can_double_swap(self._graph, route_a, route_b, ci_a, ci_b)]
+
+    def _bridge_moves(self, route):
+        """Sample double bridges of route passing pruning masks"""
+        if len(route) < 4:
+            return []
+        positions = range(1, len(route))
+        moves = set()
+        for _ in range(self._bridge_samples):
+            moves.add(tuple(sorted(self._random.sample(positions, 3))))
+        return [move for move in moves
+            if can_double_bridge(self._graph, route, *move)]
+
+    def _candidates(self, key, generate):
+        """Return stored moves by key, generate them on first access"""
+        moves = self._moves.get(key)
+        if moves is None:
+            moves = generate()
+            self._moves[key] = moves
+        return moves
+
+    def _take(self, moves):
+        """Remove random move from list in O(1)"""
+        index = self._random.randrange(len(moves))
+        moves[index], moves[-1] = moves[-1], moves[index]
+        return moves.pop()
+
+    def _try_swap(self, solution, ri_a, ri_b):
+        """Try to perform random stored double swap of two routes"""
+        route_a, route_b = solution[ri_a], solution[ri_b]
+        key = (SWAP, solution.route_fingerprint(ri_a),
+            solution.route_fingerprint(ri_b))
+        moves = self._candidates(key,
+            lambda: self._swap_moves(route_a, route_b))
+        if not moves:
+            return None
+        ci_a, ci_b = self._take(moves)
+        move_hash = hash((SWAP, route_a[ci_a].id, route_a[ci_a+1].id,
+            route_b[ci_b].id, route_b[ci_b+1].id))
+        if move_hash in self._history:
+            return None
+        new_route_a, new_route_b = double_swap(route_a, route_b, ci_a, ci_b)
+        if not route_satisfies_constraints(self._graph, new_route_a) or \
+                not route_satisfies_constraints(self._graph, new_route_b):
+            return None
+        self._history[move_hash] = True
+        return solution.changed(new_route_a, ri_a).changed(new_route_b, ri_b)
+
+    def _try_bridge(self, solution, ri):
+        """Try to perform random stored double bridge of route"""
+        route = solution[ri]
+        key = (BRIDGE, solution.route_fingerprint(ri))
+        moves = self._candidates(key, lambda: self._bridge_moves(route))
+        if not moves:
+            return None
+        i, j, k = self._take(moves)
+        move_hash = hash((BRIDGE, route[i-1].id, route[i].id, route[j-1].id,
+            route[j].id, route[k-1].id, route[k].id))
+        if move_hash in self._history:
+            return None
+        new_route = double_bridge(route, i, j, k)
+        if not route_satisfies_constraints(self._graph, new_route):
+            return None
+        self._history[move_hash] = True
+        return solution.changed(new_route, ri)
+
+    def perturb(self, objective, solution):
+        """
+        Return solution perturbed by single feasible move, solution itself
+        if no feasible move found within attempts
+        """
+        if not len(solution):
+            return solution
+        for _ in range(self._attempts):
+            ri_a = self._pick_route(objective, solution)
+            new_solution = None
+            if len(solution) > 1 and self._random.random() < self._swap_share:
+                ri_b = self._random.randrange(len(solution) - 1)
+                if ri_b >= ri_a:
+                    ri_b += 1
+                new_solution = self._try_swap(solution, ri_a, ri_b)
+            else:
+                new_solution = self._try_bridge(solution, ri_a)
+            if new_solution is not None:
+                return new_solution
+        return solution
+
+
+class PerturbationTests(unittest.TestCase):
+    """Unit Tests for perturbation methods"""
+
+    def setUp(self):
+        from io import StringIO
+        self.graph = Graph(StringIO(search.SearchUtilsTests.BASIC_VRP))
+        super(PerturbationTests, self).setUp()
+        def distance(graph, solution, md):
+            """Calculate distance of route or solution"""
+            routes = solution if md is None else [solution[md['ri']]]
+            return sum(graph.costs[(route[i], route[i+1])]
+                for route in routes for i in range(len(route)-1))
+        self.obj = distance
+
+    def test_double_swap_and_bridge_work(self):
+        a = [0, 1, 2, 3, 0]
+        b = [0, 4, 5, 0]
+        self.assertEqual(([0, 5, 4, 3, 0], [0, 2, 1, 0]),
+            double_swap(a, b, 1, 1))
+        self.assertEqual([0, 3, 4, 1, 2, 0],
+            double_bridge([0, 1, 2, 3, 4, 0], 1, 3, 5))
+
+    def test_perturbation_keeps_solution_feasible(self):
+        S = construct_initial_solution(self.graph, self.obj)
+        self.assertTrue(satisfies_all_constraints(self.graph, S))
+        pool = PerturbationPool(self.graph, history_size=8, seed=1)
+        changed = 0
+        for _ in range(20):
+            new_S = pool.perturb(self.obj, S)
+            self.assertTrue(satisfies_all_constraints(self.graph, new_S))
+            changed += new_S != S
+            S = new_S
+        self.assertTrue(changed)
+        self.assertTrue(len(pool.history) <= 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,10 @@ import unittest
 import concurrent.futures as futures
 import multiprocessing
 import copy
+import random
+import threading
+import time
+from collections import OrderedDict
 
 
 # local imports
@@ -26,10 +30,18 @@ def import_from(rel_path):
 with import_from('../'):
     from lib.graph import Solution
     from lib.graph import Graph
+    from lib.graph import MOVE_RELOCATE
+    from lib.graph import MOVE_EXCHANGE
     from lib.customer import Customer
     from lib.local_search_strategies import two_opt
     from lib.local_search_strategies import relocate
     from lib.local_search_strategies import exchange
+    from lib.local_search_strategies import two_opt_deltas
+    from lib.local_search_strategies import random_generator
+    from lib.local_search_strategies import relocate_move
+    from lib.local_search_strategies import exchange_move
+    from lib.local_search_strategies import DistanceObjective
+    from lib.local_search_strategies import route_pair_pool
     from lib.constraints import satisfies_all_constraints
     from lib.constraints import route_satisfies_constraints
 
@@ -158,6 +170,37 @@ def construct_initial_solution(graph, objective, md=None):
     return _average_capacity_initial(graph)
 
 
+# bounded history
+class LruCache(object):
+    """Size-capped mapping which evicts least recently used entries"""
+    def __init__(self, maxsize=1024):
+        """Init method"""
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """Return value by key and mark it as recently used"""
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def __setitem__(self, key, value):
+        """Overload for operator[] setter"""
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def __contains__(self, key):
+        """Check whether key is stored"""
+        return key in self._entries
+
+    def __len__(self):
+        """Number of stored entries"""
+        return len(self._entries)
+
+
 # local search
 def local_search_methods():
     """Return available methods used in local search"""
@@ -168,33 +211,191 @@ def local_search_methods():
     }
 
 
-def _do_method(method, graph, O, S, md=None):
-    S = method(graph, O, S, md)
-    return (O(graph, S, md), S)
+LS_SETTINGS = ('two_opt', 'ls_mode', 'ls_stats', 'pair_pool', 'random')  # md keys that configure LS
 
 
-def local_search(graph, objective, solution, md=None, excludes=[]):
-    """Perform local search"""
+def ls_settings(md):
+    """Return local search settings from method specific data"""
+    if not md:
+        return None
+    return {key: md[key] for key in LS_SETTINGS if key in md}
+
+
+class OperatorStats(object):
+    """
+    Credit assignment for local search operators
+
+    Credit of operator is exponentially smoothed improvement of objective per
+    CPU-second spent in operator
+    """
+    def __init__(self, reaction=0.3, min_share=0.05):
+        """Init method"""
+        self._reaction = reaction  # weight of the latest reward
+        self._min_share = min_share  # min selection weight relative to max
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, name):
+        """Return (create if needed) stats of operator"""
+        if name not in self._stats:
+            self._stats[name] = {
+                'calls': 0, 'improved': 0, 'cpu': 0.0, 'gain': 0.0,
+                'credit': None}
+        return self._stats[name]
+
+    def record(self, name, improvement, cpu_time):
+        """Record operator run"""
+        reward = max(improvement, 0.0) / max(cpu_time, 1e-6)
+        with self._lock:
+            entry = self._entry(name)
+            entry['calls'] += 1
+            entry['cpu'] += cpu_time
+            entry['gain'] += max(improvement, 0.0)
+            if improvement > 0:
+                entry['improved'] += 1
+            if entry['credit'] is None:
+                entry['credit'] = reward
+            else:
+                entry['credit'] += self._reaction * (reward - entry['credit'])
+
+    def credit(self, name):
+        """Current credit of operator (None if never run)"""
+        return self._entry(name)['credit']
+
+    def choose(self, names, rng=None):
+        """Roulette wheel selection of operator by credit"""
+        rng = rng or random.Random()
+        credits = [self.credit(name) for name in names]
+        for name, credit in zip(names, credits):
+            if credit is None:  # try every operator at least once
+                return name
+        floor = max(max(credits) * self._min_share, 1e-9)
+        weights = [max(credit, floor) for credit in credits]
+        pick = rng.uniform(0, sum(weights))
+        for name, weight in zip(names, weights):
+            pick -= weight
+            if pick <= 0:
+                return name
+        return names[-1]
+
+    def summary(self):
+        """Return stats per operator as list of str"""
+        lines = []
+        for name in sorted(self._stats):
+            entry = self._stats[name]
+            lines.append(
+                '{name}: calls={calls} improved={improved} cpu={cpu:.2f}s '
+                'gain={gain:.2f} credit={credit:.2f}/s'.format(
+                    name=name, calls=entry['calls'], improved=entry['improved'],
+                    cpu=entry['cpu'], gain=entry['gain'],
+                    credit=entry['credit'] or 0.0))
+        return lines
+
+
+def _do_method(name, method, graph, O, S, md=None):
+    """Run single local search method and record its stats"""
+    stats = md.get('ls_stats') if md else None
+    start = time.thread_time()
+    new_S = method(graph, O, S, md)
+    new_O = O(graph, new_S, md)
+    if stats is not None:
+        stats.record(name, O(graph, S, md) - new_O, time.thread_time() - start)
+    return (new_O, new_S)
+
+
+def _all_methods(graph, objective, solution, methods, md=None):
+    """
+    Run every method on the same solution, return the best result
+
+    Note: every method gets own random generator seeded from md['random'],
+    so that concurrent methods do not interleave draws
+    """
     single_thread = False
-    methods = local_search_methods()
-    for excluded_method_name in excludes:
-        del methods[excluded_method_name]
+    rng = random_generator(md)
+    mds = [dict(md or {}, random=random.Random(rng.getrandbits(64)))
+        for _ in methods]
     results = []
     if single_thread:
-        for method in methods.values():
-            S = method(graph, objective, solution, md)
-            results.append((objective(graph, S, md), S))
+        for (name, method), method_md in zip(methods.items(), mds):
+            results.append(
+                _do_method(name, method, graph, objective, solution, method_md))
     else:
         with futures.ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
-            future_per_search_method = {executor.submit(_do_method, m, graph, objective, solution, md): name for name, m in methods.items()}
-            for future in futures.as_completed(future_per_search_method):
+            future_per_search_method = [executor.submit(_do_method, name, m, graph, objective, solution, method_md) for (name, m), method_md in zip(methods.items(), mds)]
+            for future in future_per_search_method:
                 results.append(future.result())
     if not results:
         raise Exception('None of the available methods evaluated')
-    # get solution that gives best objective
+    # get solution that gives best objective (ties: first method wins)
     return sorted(results, key=lambda x: x[0])[0][1]
 
 
+def _variable_neighbourhood_descent(graph, objective, solution, methods,
+        md=None):
+    """
+    Chain methods: after improvement start over from the first method, stop
+    when none of the methods improves the solution
+    """
+    names = list(methods.keys())
+    curr_O = objective(graph, solution, md)
+    k = 0
+    while k < len(names):
+        new_O, new_S = _do_method(
+            names[k], methods[names[k]], graph, objective, solution, md)
+        if new_O < curr_O:
+            solution, curr_O = new_S, new_O
+            k = 0
+        else:
+            k += 1
+    return solution
+
+
+def _adaptive_search(graph, objective, solution, methods, md=None):
+    """
+    Pick methods by roulette wheel over their credits until every method
+    fails to improve the current solution
+    """
+    stats = md.get('ls_stats') if md else None
+    if stats is None:
+        stats = OperatorStats()
+        md = dict(md or {}, ls_stats=stats)
+    curr_O = objective(graph, solution, md)
+    failed = set()
+    while len(failed) < len(methods):
+        name = stats.choose([n for n in methods if n not in failed],
+            random_generator(md))
+        new_O, new_S = _do_method(
+            name, methods[name], graph, objective, solution, md)
+        if new_O < curr_O:
+            solution, curr_O = new_S, new_O
+            failed = set()
+        else:
+            failed.add(name)
+    return solution
+
+
+def local_search_modes():
+    """Return available ways to combine local search methods"""
+    return {
+        'all': _all_methods,
+        'vnd': _variable_neighbourhood_descent,
+        'adaptive': _adaptive_search
+    }
+
+
+def local_search(graph, objective, solution, md=None, excludes=[]):
+    """
+    Perform local search
+
+    Note: md['ls_mode'] selects how methods are combined (see
+    local_search_modes), md['ls_stats'] collects OperatorStats
+    """
+    methods = local_search_methods()
+    for excluded_method_name in excludes:
+        del methods[excluded_method_name]
+    mode = md.get('ls_mode', 'all') if md else 'all'
+    return local_search_modes()[mode](graph, objective, solution, methods, md)
+
 
 # Unit Tests
 class SearchUtilsTests(unittest.TestCase):
@@ -254,6 +455,153 @@ CUST NO.   XCOORD.   YCOORD.   DEMAND    READY TIME   DUE DATE   SERVICE TIME
             print(S)
             print(S_opt)
 
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = LruCache(maxsize=2)
+        cache[1] = 'a'
+        cache[2] = 'b'
+        self.assertEqual('a', cache.get(1))
+        cache[3] = 'c'
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertEqual(2, len(cache))
+
+    def test_solution_fingerprint_is_updated_per_route(self):
+        S = construct_initial_solution(self.graph, self.obj)
+        route = list(S[0])
+        route[1], route[2] = route[2], route[1]
+        changed = S.changed(route, 0)
+        self.assertEqual(Solution(list(changed.routes)).fingerprint,
+            changed.fingerprint)
+        self.assertNotEqual(S, changed)
+        self.assertEqual(S, changed.changed(S[0], 0))
+        self.assertEqual(S, Solution(list(reversed(S.routes))))
+        # fingerprint collision: routes are compared
+        changed._hash = S.fingerprint
+        self.assertNotEqual(S, changed)
+        self.assertNotEqual(S, S.ids())
+
+    def test_pruning_masks_reject_only_infeasible_routes(self):
+        depot = self.graph.depot
+        for a in self.graph.customers:
+            for b in self.graph.customers:
+                if a.is_depot or b.is_depot or a == b:
+                    continue
+                pruned = not self.graph.arc_feasible(a, b)
+                pruned |= not self.graph.fits_together(a, b)
+                if pruned:
+                    self.assertFalse(route_satisfies_constraints(
+                        self.graph, [depot, a, b, depot]))
+
+    def test_two_opt_deltas_match_objective(self):
+        import numpy as np
+        from lib.local_search_strategies import two_opt_swap
+        S = Solution([[self.graph.depot] + sorted(
+            c for c in self.graph.customers if not c.is_depot) +
+            [self.graph.depot]])
+        ids = np.array([c.id for c in S[0]])
+        deltas, _ = two_opt_deltas(self.graph, ids)
+        base_O = self.obj(self.graph, S, None)
+        for i in range(1, len(ids) - 1):
+            for k in range(i + 1, len(ids) - 1):
+                new_S = Solution([two_opt_swap(S[0], i, k)])
+                self.assertAlmostEqual(self.obj(self.graph, new_S, None),
+                    base_O + deltas[i-1, k-1])
+
+    def test_best_two_opt_works(self):
+        S = construct_initial_solution(self.graph, self.obj)
+        S_opt = two_opt(self.graph, self.obj, S, {'two_opt': 'best'})
+        self.assertTrue(satisfies_all_constraints(self.graph, S_opt))
+        self.assertLessEqual(self.obj(self.graph, S_opt, None),
+            self.obj(self.graph, S, None))
+
+    def test_memory_light_graph_matches_full_graph(self):
+        from io import StringIO
+        light = Graph(StringIO(SearchUtilsTests.BASIC_VRP), memory_light=True,
+            neighbours_k=3)
+        for a in self.graph.customers:
+            for b in self.graph.customers:
+                self.assertEqual(self.graph.costs[(a, b)], light.costs[(a, b)])
+                self.assertEqual(self.graph.arc_feasible(a, b),
+                    light.arc_feasible(a, b))
+            # compare distances: neighbours at equal distance may differ
+            nearest = [d for _, d in self.graph.neighbours[a]][:3]
+            light_nearest = [d for _, d in light.neighbours[a]][:3]
+            self.assertEqual(nearest, light_nearest)
+            self.assertIn(light.depot,
+                [c for c, _ in light.neighbours[a]] + [a])
+
+    def test_local_search_modes_work(self):
+        S = construct_initial_solution(self.graph, self.obj)
+        for mode in local_search_modes():
+            stats = OperatorStats()
+            md = {'ls_mode': mode, 'ls_stats': stats}
+            S_opt = local_search(self.graph, self.obj, S, md)
+            self.assertTrue(satisfies_all_constraints(self.graph, S_opt))
+            self.assertLess(self.obj(self.graph, S_opt, None),
+                self.obj(self.graph, S, None))
+            self.assertEqual(len(local_search_methods()), len(stats.summary()))
+
+    def test_evaluate_moves_match_objective_and_constraints(self):
+        O = DistanceObjective()
+        S = construct_initial_solution(self.graph, O)
+        moves, applies = [], []
+        for ra in range(len(S)):
+            for rb in range(len(S) + 1):
+                for pa in range(1, len(S[ra]) - 1):
+                    b_length = 2 if rb == len(S) else len(S[rb])
+                    for pb in range(1, b_length):
+                        moves.append((MOVE_RELOCATE, ra, pa, rb, pb))
+                        applies.append(relocate_move)
+                    for pb in range(1, b_length - 1):
+                        moves.append((MOVE_EXCHANGE, ra, pa, rb, pb))
+                        applies.append(exchange_move)
+        deltas, feasible = O.evaluate_moves(self.graph, S, moves)
+        self.assertTrue(feasible.any())
+        for move, apply, delta, ok in zip(moves, applies, deltas, feasible):
+            if move[1] == move[3]:
+                self.assertFalse(ok)
+                continue
+            new_S, _ = apply(S, *move[1:])
+            self.assertEqual(satisfies_all_constraints(self.graph, new_S), ok)
+            self.assertAlmostEqual(
+                O(self.graph, new_S, None) - O(self.graph, S, None), delta)
+
+    def test_route_pair_search_works(self):
+        O = DistanceObjective()
+        S = construct_initial_solution(self.graph, O)
+        pool = route_pair_pool(self.graph, 2)
+        try:
+            for method in (relocate, exchange):
+                S_opt = method(self.graph, O, S, {'pair_pool': pool})
+                self.assertTrue(satisfies_all_constraints(self.graph, S_opt))
+                self.assertLessEqual(O(self.graph, S_opt, None),
+                    O(self.graph, S, None))
+        finally:
+            pool.terminate()
+
+    def test_seeded_local_search_is_reproducible(self):
+        O = DistanceObjective()
+        S = construct_initial_solution(self.graph, O)
+        pool = route_pair_pool(self.graph, 2)
+        try:
+            for mode in ('all', 'vnd'):
+                results = []
+                for _ in range(2):
+                    md = {'ls_mode': mode, 'pair_pool': pool,
+                        'random': random.Random(5)}
+                    results.append(local_search(self.graph, O, S, md).ids())
+                self.assertEqual(results[0], results[1])
+        finally:
+            pool.terminate()
+
+    def test_operator_stats_prefer_productive_operator(self):
+        stats = OperatorStats()
+        stats.record('good', 10.0, 1.0)
+        stats.record('bad', 0.0, 1.0)
+        rng = random.Random(0)
+        picks = [stats.choose(['good', 'bad'], rng) for _ in range(200)]
+        self.assertGreater(picks.count('good'), picks.count('bad'))
+
     def test_split_route_works(self):
         def _c(id, demand=0, r_time=0, dd=0, s_time=0):
             return Customer([id, 0, 0, demand, r_time, dd, s_time])